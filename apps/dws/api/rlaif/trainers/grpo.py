@@ -22,7 +22,7 @@ import requests
 import torch
 import torch.nn.functional as F
 from torch.optim import AdamW
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
 logger = logging.getLogger(__name__)
@@ -48,6 +48,8 @@ class GRPOTrainer:
         max_seq_len: int = 4096,
         max_grad_norm: float = 1.0,
         kl_coefficient: float = 0.1,
+        quantize_reference: bool = False,
+        gradient_checkpointing: bool = True,
         device: str = "cuda" if torch.cuda.is_available() else "cpu",
     ):
         self.model_name = model_name
@@ -58,6 +60,8 @@ class GRPOTrainer:
         self.max_seq_len = max_seq_len
         self.max_grad_norm = max_grad_norm
         self.kl_coefficient = kl_coefficient
+        self.quantize_reference = quantize_reference
+        self.gradient_checkpointing = gradient_checkpointing
         self.device = device
 
         self.model = None
@@ -65,37 +69,70 @@ class GRPOTrainer:
         self.tokenizer = None
         self.optimizer = None
 
+        # Keep-alive session for the many per-CID storage requests
+        self.session = requests.Session()
+
     def setup(self, reference_model_cid: str | None = None):
         """Initialize models and optimizer"""
         logger.info(f"Loading model: {self.model_name}")
 
+        if self.device.startswith("cuda"):
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.backends.cudnn.allow_tf32 = True
+            torch.backends.cudnn.benchmark = True
+
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_name, trust_remote_code=True)
+        if not self.tokenizer.is_fast:
+            # Training masks are built from character offsets, which only fast tokenizers return
+            raise ValueError(
+                f"{self.model_name} loaded a slow tokenizer; GRPO training requires a fast "
+                "tokenizer for offset mappings"
+            )
 
         self.model = AutoModelForCausalLM.from_pretrained(
-            self.model_name, torch_dtype=torch.bfloat16, trust_remote_code=True
+            self.model_name,
+            torch_dtype=torch.bfloat16,
+            attn_implementation="sdpa",
+            trust_remote_code=True,
         )
         self.model.to(self.device)
-        self.model.gradient_checkpointing_enable()
+        if self.gradient_checkpointing:
+            self.model.gradient_checkpointing_enable(
+                gradient_checkpointing_kwargs={"use_reentrant": False}
+            )
         self.model.train()
 
         # Load or clone reference model
-        if reference_model_cid:
-            ref_path = self._download_model(reference_model_cid)
+        ref_path = (
+            self._download_model(reference_model_cid) if reference_model_cid else self.model_name
+        )
+
+        if self.quantize_reference:
+            # Frozen reference only runs forward passes, so int8 weights halve its memory
             self.ref_model = AutoModelForCausalLM.from_pretrained(
-                ref_path, torch_dtype=torch.bfloat16, trust_remote_code=True
+                ref_path,
+                torch_dtype=torch.bfloat16,
+                attn_implementation="sdpa",
+                quantization_config=BitsAndBytesConfig(load_in_8bit=True),
+                device_map={"": self.device},
+                trust_remote_code=True,
             )
         else:
-            # Clone current model as reference
             self.ref_model = AutoModelForCausalLM.from_pretrained(
-                self.model_name, torch_dtype=torch.bfloat16, trust_remote_code=True
+                ref_path,
+                torch_dtype=torch.bfloat16,
+                attn_implementation="sdpa",
+                trust_remote_code=True,
             )
+            self.ref_model.to(self.device)
 
-        self.ref_model.to(self.device)
         self.ref_model.eval()
         for param in self.ref_model.parameters():
             param.requires_grad = False
 
-        self.optimizer = AdamW(self.model.parameters(), lr=self.learning_rate)
+        self.optimizer = AdamW(
+            self.model.parameters(), lr=self.learning_rate, fused=self.device.startswith("cuda")
+        )
 
         logger.info(f"Model loaded on {self.device}")
 
@@ -124,12 +161,21 @@ class GRPOTrainer:
 
             # Convert trajectory to training format
             messages = self._trajectory_to_messages(trajectory)
-            tokens = self.tokenizer.apply_chat_template(
-                messages, return_tensors="pt", truncation=True, max_length=self.max_seq_len
-            )[0]
+
+            # Render the chat template once and reuse the text for tokens and mask
+            text = self.tokenizer.apply_chat_template(messages, tokenize=False)
+            encoded = self.tokenizer(
+                text,
+                add_special_tokens=False,
+                truncation=True,
+                max_length=self.max_seq_len,
+                return_offsets_mapping=True,
+                return_tensors="pt",
+            )
+            tokens = encoded.input_ids[0]
 
             # Create mask (train on assistant tokens only)
-            mask = self._create_training_mask(messages, tokens)
+            mask = self._create_training_mask(text, tokens, encoded.offset_mapping[0])
 
             training_data.append(
                 {
@@ -178,16 +224,14 @@ class GRPOTrainer:
 
         return messages
 
-    def _create_training_mask(self, messages: list[dict], tokens: torch.Tensor) -> torch.Tensor:
+    def _create_training_mask(
+        self, text: str, tokens: torch.Tensor, offsets: torch.Tensor
+    ) -> torch.Tensor:
         """Create mask for training (1 for assistant tokens, -100 for others)"""
-        assert self.tokenizer is not None, "Tokenizer not initialized"
         mask = torch.full_like(tokens, -100)
+        token_starts = offsets[:, 0]
 
-        # Simple approach: find assistant response regions
-        # In practice, use tokenizer's chat template metadata
-        text = self.tokenizer.apply_chat_template(messages, tokenize=False)
-
-        # Find assistant sections and mark them
+        # Find assistant sections in the rendered template and mark them
         assistant_start = "<|im_start|>assistant"
         assistant_end = "<|im_end|>"
 
@@ -201,23 +245,23 @@ class GRPOTrainer:
             if end == -1:
                 end = len(text)
 
-            # Get token positions for this range
-            prefix = text[: start + len(assistant_start) + 1]
-            content = text[start + len(assistant_start) + 1 : end]
-
-            prefix_tokens = len(self.tokenizer.encode(prefix))
-            content_tokens = len(self.tokenizer.encode(content))
-
-            # Mark these tokens as trainable
-            for i in range(prefix_tokens, min(prefix_tokens + content_tokens, len(mask))):
-                mask[i] = tokens[i]
+            # Mark tokens whose characters start inside the assistant content as trainable.
+            # Offsets come from the same tokenization as the ids, so spans cannot drift
+            # the way re-encoding the prefix and content separately could at BPE merges.
+            content_start = start + len(assistant_start) + 1
+            in_content = (token_starts >= content_start) & (token_starts < end)
+            mask[in_content] = tokens[in_content]
 
             start_idx = end
 
         return mask
 
-    def train_step(self, batch_data: list[dict]) -> dict:
-        """Execute one GRPO training step"""
+    def train_step(self, batch_data: list[dict], accumulation_steps: int) -> dict:
+        """Execute one GRPO training step
+
+        The loss is divided by ``accumulation_steps``, the number of batches in the
+        current accumulation window, so the stepped gradient is their mean.
+        """
         assert self.model is not None
         assert self.ref_model is not None
 
@@ -242,29 +286,25 @@ class GRPOTrainer:
             if std > 1e-8:
                 scores = scores / std
 
-        # Pad sequences
+        # Pad sequences into preallocated arrays
         max_len = max(len(t) for t in tokens_list)
         max_len = ((max_len - 1) // 64 + 1) * 64  # Pad to multiple of 64
 
-        for i in range(len(tokens_list)):
-            pad_len = max_len - len(tokens_list[i])
-            tokens_list[i] = np.concatenate([tokens_list[i], np.zeros(pad_len, dtype=np.int32)])
-            masks_list[i] = np.concatenate([masks_list[i], np.full(pad_len, -100, dtype=np.int32)])
+        padded_tokens = np.zeros((len(tokens_list), max_len), dtype=np.int64)
+        padded_masks = np.full((len(masks_list), max_len), -100, dtype=np.int64)
+        for i, (item_tokens, item_mask) in enumerate(zip(tokens_list, masks_list, strict=True)):
+            padded_tokens[i, : len(item_tokens)] = item_tokens
+            padded_masks[i, : len(item_mask)] = item_mask
 
         # Convert to tensors
-        tokens = torch.tensor(np.stack(tokens_list)[:, :-1]).to(self.device)
-        labels = torch.tensor(np.stack(masks_list)[:, 1:]).to(self.device)
+        tokens = torch.from_numpy(np.ascontiguousarray(padded_tokens[:, :-1])).to(self.device)
+        labels = torch.from_numpy(np.ascontiguousarray(padded_masks[:, 1:])).to(self.device)
         advantages = torch.tensor(scores, dtype=torch.float32).view(-1, 1).to(self.device)
 
         # Forward pass - policy model
-        outputs = self.model(tokens)
+        outputs = self.model(tokens, use_cache=False)
         logits = outputs.logits
 
-        # Forward pass - reference model
-        with torch.no_grad():
-            ref_outputs = self.ref_model(tokens)
-            ref_logits = ref_outputs.logits
-
         # Calculate log probabilities
         logp = -F.cross_entropy(
             logits.view(-1, logits.size(-1)),
@@ -273,12 +313,17 @@ class GRPOTrainer:
             ignore_index=-100,
         ).view(labels.shape)
 
-        ref_logp = -F.cross_entropy(
-            ref_logits.view(-1, ref_logits.size(-1)),
-            labels.view(-1),
-            reduction="none",
-            ignore_index=-100,
-        ).view(labels.shape)
+        # Forward pass - reference model. Reduce to per-token log probs inside no_grad
+        # so the reference logits are released before the policy backward pass.
+        with torch.no_grad():
+            ref_logits = self.ref_model(tokens, use_cache=False).logits
+            ref_logp = -F.cross_entropy(
+                ref_logits.view(-1, ref_logits.size(-1)),
+                labels.view(-1),
+                reduction="none",
+                ignore_index=-100,
+            ).view(labels.shape)
+            del ref_logits
 
         # Mask for valid tokens
         mask = (labels != -100).float()
@@ -296,10 +341,10 @@ class GRPOTrainer:
         kl_loss = self.kl_coefficient * kl.mean()
 
         # Total loss
-        loss = (grpo_loss + kl_loss) / self.gradient_accumulation_steps
+        loss = (grpo_loss + kl_loss) / accumulation_steps
         loss.backward()
 
-        total_loss = loss.item() * self.gradient_accumulation_steps
+        total_loss = loss.item() * accumulation_steps
 
         return {
             "loss": total_loss,
@@ -338,17 +383,22 @@ class GRPOTrainer:
                 end = min(start + self.batch_size, len(training_data))
                 batch = training_data[start:end]
 
-                metrics = self.train_step(batch)
+                # The final window of an epoch may hold fewer than gradient_accumulation_steps
+                window_start = batch_idx - batch_idx % self.gradient_accumulation_steps
+                window_len = min(self.gradient_accumulation_steps, num_batches - window_start)
+                metrics = self.train_step(batch, window_len)
 
-                # Accumulate gradients
-                if (batch_idx + 1) % self.gradient_accumulation_steps == 0:
+                # Accumulate gradients, stepping on any remainder at the end of the epoch
+                if (batch_idx + 1) % self.gradient_accumulation_steps == 0 or (
+                    batch_idx + 1 == num_batches
+                ):
                     assert self.model is not None, "Model not initialized"
                     assert self.optimizer is not None, "Optimizer not initialized"
                     grad_norm = torch.nn.utils.clip_grad_norm_(
                         self.model.parameters(), max_norm=self.max_grad_norm
                     )
                     self.optimizer.step()
-                    self.optimizer.zero_grad()
+                    self.optimizer.zero_grad(set_to_none=True)
 
                     metrics["grad_norm"] = grad_norm.item()
                     all_metrics.append(metrics)
@@ -397,7 +447,7 @@ class GRPOTrainer:
         tar_buffer.seek(0)
 
         # Upload to storage
-        response = requests.post(
+        response = self.session.post(
             f"{self.storage_url}/upload",
             files={"file": ("checkpoint.tar.gz", tar_buffer, "application/gzip")},
         )
@@ -410,7 +460,7 @@ class GRPOTrainer:
 
     def _fetch_from_storage(self, cid: str) -> dict:
         """Fetch JSON data from Jeju Storage"""
-        response = requests.get(f"{self.storage_url}/get/{cid}")
+        response = self.session.get(f"{self.storage_url}/get/{cid}")
         if not response.ok:
             raise RuntimeError(f"Failed to fetch {cid}: {response.status_code}")
         return response.json()
@@ -420,7 +470,7 @@ class GRPOTrainer:
         import tarfile
         import tempfile
 
-        response = requests.get(f"{self.storage_url}/get/{cid}", stream=True)
+        response = self.session.get(f"{self.storage_url}/get/{cid}", stream=True)
         if not response.ok:
             raise RuntimeError(f"Failed to download model {cid}: {response.status_code}")
 
@@ -442,8 +492,21 @@ def main():
     parser.add_argument("--output", default="./output", help="Output directory")
     parser.add_argument("--epochs", type=int, default=1, help="Number of epochs")
     parser.add_argument("--batch-size", type=int, default=4, help="Batch size")
+    parser.add_argument(
+        "--accum-steps", type=int, default=8, help="Batches accumulated per optimizer step"
+    )
     parser.add_argument("--lr", type=float, default=1e-5, help="Learning rate")
     parser.add_argument("--kl-coeff", type=float, default=0.1, help="KL coefficient")
+    parser.add_argument(
+        "--quantize-reference",
+        action="store_true",
+        help="Load the frozen reference model in int8 (requires bitsandbytes)",
+    )
+    parser.add_argument(
+        "--no-gradient-checkpointing",
+        action="store_true",
+        help="Keep activations instead of recomputing them (faster when memory allows)",
+    )
     parser.add_argument("--upload", action="store_true", help="Upload checkpoint to storage")
 
     args = parser.parse_args()
@@ -453,7 +516,10 @@ def main():
         storage_url=args.storage_url,
         learning_rate=args.lr,
         batch_size=args.batch_size,
+        gradient_accumulation_steps=args.accum_steps,
         kl_coefficient=args.kl_coeff,
+        quantize_reference=args.quantize_reference,
+        gradient_checkpointing=not args.no_gradient_checkpointing,
     )
 
     trainer.setup(reference_model_cid=args.reference_model)
@@ -22,12 +22,19 @@ from pathlib import Path
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
+# Base models loaded by merge_pytorch_adapter, keyed by name or path. Repeated merges of
+# checkpoints from the same run deep-copy the cached weights instead of re-reading them.
+_base_model_cache: dict = {}
+
 
 def merge_pytorch_adapter(adapter_dir: str, output_dir: str, base_model: str | None = None) -> int:
     """Merge PyTorch/PEFT adapter into base model."""
+    import copy
+    import json
+
     import torch
-    from peft import AutoPeftModelForCausalLM
-    from transformers import AutoTokenizer
+    from peft import PeftModel
+    from transformers import AutoModelForCausalLM, AutoTokenizer
 
     logger.info("=" * 60)
     logger.info("MERGING PYTORCH/PEFT ADAPTER")
@@ -35,11 +42,22 @@ def merge_pytorch_adapter(adapter_dir: str, output_dir: str, base_model: str | N
     logger.info(f"Adapter: {adapter_dir}")
     logger.info(f"Output: {output_dir}")
 
+    if base_model is None:
+        with open(Path(adapter_dir) / "adapter_config.json") as f:
+            base_model = json.load(f)["base_model_name_or_path"]
+    logger.info(f"Base model: {base_model}")
+
+    # Load base once per process; merge_and_unload mutates weights, so merge into a copy
+    if base_model not in _base_model_cache:
+        logger.info("Loading base model...")
+        _base_model_cache[base_model] = AutoModelForCausalLM.from_pretrained(
+            base_model, torch_dtype=torch.float16
+        )
+    base = copy.deepcopy(_base_model_cache[base_model])
+
     # Load adapter
     logger.info("Loading adapter...")
-    model = AutoPeftModelForCausalLM.from_pretrained(
-        adapter_dir, device_map="auto", torch_dtype=torch.float16
-    )
+    model = PeftModel.from_pretrained(base, adapter_dir)
 
     # Load tokenizer
     tokenizer = AutoTokenizer.from_pretrained(adapter_dir)
@@ -18,6 +18,9 @@ Usage:
     # Interactive mode
     python scripts/test.py --adapter-path ./trained_models/adapters --interactive
 
+    # Interactive mode on vLLM (CUDA only)
+    python scripts/test.py --model-path ./trained_models/model --engine vllm --interactive
+
     # Run validation
     python scripts/test.py --adapter-path ./trained_models/adapters --validate
 """
@@ -26,6 +29,7 @@ import argparse
 import json
 import logging
 import os
+import re
 import sys
 from pathlib import Path
 from typing import Literal
@@ -41,6 +45,11 @@ if env_path.exists():
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
+# One case-insensitive pass per response; substring matches ("buying", "markets") count
+_TRADING_KEYWORDS_RE = re.compile(
+    "trade|buy|sell|market|position|risk|profit|analyze|decision", re.IGNORECASE
+)
+
 
 def detect_backend() -> Literal["mlx", "cuda", "cpu"]:
     """Auto-detect backend."""
@@ -65,6 +74,16 @@ def detect_backend() -> Literal["mlx", "cuda", "cpu"]:
     return "cpu"
 
 
+def configure_torch_backends() -> None:
+    """Enable TF32 matmuls and cuDNN autotuning (free throughput on Ampere+ GPUs)."""
+    import torch
+
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    torch.backends.cudnn.benchmark = True
+    torch.set_float32_matmul_precision("high")
+
+
 def get_test_prompts() -> list[str]:
     """Standard test prompts for trading agents."""
     return [
@@ -116,10 +135,10 @@ def load_mlx_model(adapter_path: str, base_model: str):
     return model, tokenizer, "mlx"
 
 
-def load_pytorch_model(model_path: str):
-    """Load PyTorch model (CUDA or CPU)."""
+def load_pytorch_model(model_path: str, int8: bool = False, compile_model: bool = False):
+    """Load PyTorch model (CUDA or CPU), optionally quantized to int8 and/or compiled."""
     import torch
-    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
 
     backend = "cuda" if torch.cuda.is_available() else "cpu"
 
@@ -128,18 +147,84 @@ def load_pytorch_model(model_path: str):
     logger.info("=" * 60)
     logger.info(f"Model path: {model_path}")
 
+    if backend == "cuda":
+        configure_torch_backends()
+        dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    else:
+        dtype = torch.float32
+
     tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
     model = AutoModelForCausalLM.from_pretrained(
         model_path,
-        torch_dtype=torch.float16 if backend == "cuda" else torch.float32,
+        torch_dtype=dtype,
         device_map="auto" if backend == "cuda" else None,
+        quantization_config=(
+            BitsAndBytesConfig(load_in_8bit=True) if int8 and backend == "cuda" else None
+        ),
         trust_remote_code=True,
     )
 
-    logger.info("Model loaded successfully")
+    if int8 and backend == "cpu":
+        # Dynamic int8 quantization of the linear layers for CPU inference
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if compile_model:
+        # generate() calls forward() per token, so compile that with a static KV cache to keep
+        # shapes fixed; the first calls are slow while graphs are captured
+        model.generation_config.cache_implementation = "static"
+        model.forward = torch.compile(
+            model.forward, mode="reduce-overhead", fullgraph=False, dynamic=False
+        )
+
+    logger.info(f"Model loaded successfully{' (int8)' if int8 else ''}")
     return model, tokenizer, backend
 
 
+def load_draft_model(draft_path: str, model):
+    """Load a small draft model for speculative decoding on the main model's device/dtype."""
+    from transformers import AutoModelForCausalLM
+
+    logger.info(f"Draft model: {draft_path}")
+    return AutoModelForCausalLM.from_pretrained(
+        draft_path,
+        torch_dtype=model.dtype,
+        device_map={"": model.device} if model.device.type == "cuda" else None,
+        trust_remote_code=True,
+    )
+
+
+def load_vllm_model(model_path: str):
+    """Load a full model into an in-process vLLM engine (CUDA only)."""
+    from vllm import LLM  # type: ignore
+
+    logger.info("=" * 60)
+    logger.info("LOADING vLLM MODEL")
+    logger.info("=" * 60)
+    logger.info(f"Model path: {model_path}")
+
+    # Prefix caching reuses the chat template's KV blocks across prompts and chat turns
+    llm = LLM(model=model_path, dtype="auto", max_model_len=2048, enable_prefix_caching=True)
+
+    logger.info("Model loaded successfully")
+    return llm, llm.get_tokenizer(), "vllm"
+
+
+def generate_vllm(llm, tokenizer, prompts: list[str], max_tokens: int = 300) -> list[str]:
+    """Generate responses for several prompts with vLLM's continuous batching."""
+    from vllm import SamplingParams  # type: ignore
+
+    formatted = [
+        tokenizer.apply_chat_template(
+            [{"role": "user", "content": prompt}], tokenize=False, add_generation_prompt=True
+        )
+        for prompt in prompts
+    ]
+    outputs = llm.generate(
+        formatted, SamplingParams(temperature=0.7, max_tokens=max_tokens), use_tqdm=False
+    )
+    return [output.outputs[0].text for output in outputs]
+
+
 def generate_mlx(model, tokenizer, prompt: str, max_tokens: int = 300) -> str:
     """Generate response using MLX."""
     from mlx_lm import generate  # type: ignore
@@ -150,44 +235,88 @@ def generate_mlx(model, tokenizer, prompt: str, max_tokens: int = 300) -> str:
     return response
 
 
-def generate_pytorch(model, tokenizer, prompt: str, backend: str, max_tokens: int = 300) -> str:
+def generate_pytorch(
+    model, tokenizer, prompt: str, backend: str, max_tokens: int = 300, draft_model=None
+) -> str:
     """Generate response using PyTorch."""
+    return generate_pytorch_batch(model, tokenizer, [prompt], backend, max_tokens, draft_model)[0]
+
+
+def generate_pytorch_batch(
+    model,
+    tokenizer,
+    prompts: list[str],
+    backend: str,
+    max_tokens: int = 300,
+    draft_model=None,
+) -> list[str]:
+    """Generate responses for several prompts with a single left-padded generate call.
+
+    With a draft model, decoding is speculative; HF assisted generation only
+    supports a batch size of 1, so prompts are then generated one at a time.
+    """
+    if draft_model is not None and len(prompts) > 1:
+        return [
+            generate_pytorch(model, tokenizer, prompt, backend, max_tokens, draft_model)
+            for prompt in prompts
+        ]
+
+    formatted = [
+        tokenizer.apply_chat_template(
+            [{"role": "user", "content": prompt}], tokenize=False, add_generation_prompt=True
+        )
+        for prompt in prompts
+    ]
 
-    messages = [{"role": "user", "content": prompt}]
-    formatted = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    # Decoder-only models must be left-padded so every prompt ends at the same position
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
 
-    inputs = tokenizer(formatted, return_tensors="pt")
+    inputs = tokenizer(formatted, return_tensors="pt", padding=True)
     if backend == "cuda":
         inputs = {k: v.cuda() for k, v in inputs.items()}
 
+    speculative = (
+        {
+            "assistant_model": draft_model,
+            "num_assistant_tokens": 5,
+            "num_assistant_tokens_schedule": "heuristic",
+        }
+        if draft_model is not None
+        else {}
+    )
     outputs = model.generate(
         **inputs,
         max_new_tokens=max_tokens,
         temperature=0.7,
         do_sample=True,
-        pad_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+        **speculative,
     )
 
-    response = tokenizer.decode(
-        outputs[0][inputs["input_ids"].shape[1] :], skip_special_tokens=True
-    )
-    return response
+    prompt_len = inputs["input_ids"].shape[1]
+    return tokenizer.batch_decode(outputs[:, prompt_len:], skip_special_tokens=True)
 
 
-def run_tests(model, tokenizer, backend: str, prompts: list[str]) -> dict:
+def run_tests(model, tokenizer, backend: str, prompts: list[str], draft_model=None) -> dict:
     """Run inference on test prompts."""
     results = []
 
-    for i, prompt in enumerate(prompts):
+    # PyTorch and vLLM decode all prompts together; MLX generates one prompt at a time
+    if backend == "mlx":
+        responses = [generate_mlx(model, tokenizer, prompt) for prompt in prompts]
+    elif backend == "vllm":
+        responses = generate_vllm(model, tokenizer, prompts)
+    else:
+        responses = generate_pytorch_batch(
+            model, tokenizer, prompts, backend, draft_model=draft_model
+        )
+
+    for i, (prompt, response) in enumerate(zip(prompts, responses, strict=True)):
         logger.info(f"\nTest {i + 1}/{len(prompts)}")
         logger.info("-" * 60)
         logger.info(f"Prompt: {prompt[:100]}...")
-
-        if backend == "mlx":
-            response = generate_mlx(model, tokenizer, prompt)
-        else:
-            response = generate_pytorch(model, tokenizer, prompt, backend)
-
         logger.info(f"Response: {response[:200]}...")
 
         results.append(
@@ -210,18 +339,6 @@ def validate_responses(results: dict) -> dict:
         "issues": [],
     }
 
-    trading_keywords = [
-        "trade",
-        "buy",
-        "sell",
-        "market",
-        "position",
-        "risk",
-        "profit",
-        "analyze",
-        "decision",
-    ]
-
     for i, result in enumerate(results["results"]):
         response = result["response"]
 
@@ -230,7 +347,7 @@ def validate_responses(results: dict) -> dict:
             validation["failed"] += 1
             continue
 
-        has_keywords = any(keyword in response.lower() for keyword in trading_keywords)
+        has_keywords = _TRADING_KEYWORDS_RE.search(response) is not None
 
         if not has_keywords:
             validation["issues"].append(f"Test {i + 1}: Response lacks trading-related content")
@@ -242,7 +359,7 @@ def validate_responses(results: dict) -> dict:
     return validation
 
 
-def interactive_mode(model, tokenizer, backend: str):
+def interactive_mode(model, tokenizer, backend: str, draft_model=None):
     """Run interactive chat with the model."""
     logger.info("\n" + "=" * 60)
     logger.info("INTERACTIVE MODE")
@@ -271,8 +388,10 @@ Task: Analyze the market and make a trading decision."""
 
         if backend == "mlx":
             response = generate_mlx(model, tokenizer, prompt)
+        elif backend == "vllm":
+            response = generate_vllm(model, tokenizer, [prompt])[0]
         else:
-            response = generate_pytorch(model, tokenizer, prompt, backend)
+            response = generate_pytorch(model, tokenizer, prompt, backend, draft_model=draft_model)
 
         print("\n" + "=" * 40)
         print("RESPONSE:")
@@ -303,6 +422,27 @@ def main() -> int:
         "--validate", action="store_true", help="Run validation checks on responses"
     )
     parser.add_argument("--interactive", action="store_true", help="Run interactive chat mode")
+    parser.add_argument(
+        "--engine",
+        choices=["hf", "vllm"],
+        default="hf",
+        help="Inference engine for --model-path (vllm requires CUDA; other PyTorch flags ignored)",
+    )
+    parser.add_argument(
+        "--int8",
+        action="store_true",
+        help="Quantize the PyTorch model to int8 (bitsandbytes on CUDA, dynamic on CPU)",
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="torch.compile the PyTorch model (slow first call; for long or interactive runs)",
+    )
+    parser.add_argument(
+        "--draft-model",
+        help="Small model sharing the tokenizer (e.g. Qwen/Qwen2.5-0.5B-Instruct) used for "
+        "speculative decoding (CUDA/CPU only)",
+    )
     parser.add_argument("--custom-prompts", nargs="+", help="Custom test prompts")
     parser.add_argument("--output", help="Save results to JSON file")
 
@@ -325,18 +465,32 @@ def main() -> int:
             logger.error(f"Model path not found: {args.model_path}")
             return 1
 
-        model, tokenizer, backend = load_pytorch_model(args.model_path)
+        if args.engine == "vllm":
+            if detect_backend() != "cuda":
+                logger.error("vLLM engine requires a CUDA GPU")
+                return 1
+            model, tokenizer, backend = load_vllm_model(args.model_path)
+        else:
+            model, tokenizer, backend = load_pytorch_model(
+                args.model_path, int8=args.int8, compile_model=args.compile
+            )
+
+    draft_model = (
+        load_draft_model(args.draft_model, model)
+        if args.draft_model and backend in ("cuda", "cpu")
+        else None
+    )
 
     # Interactive mode
     if args.interactive:
-        interactive_mode(model, tokenizer, backend)
+        interactive_mode(model, tokenizer, backend, draft_model)
         return 0
 
     # Get test prompts
     prompts = args.custom_prompts if args.custom_prompts else get_test_prompts()
 
     # Run tests
-    results = run_tests(model, tokenizer, backend, prompts)
+    results = run_tests(model, tokenizer, backend, prompts, draft_model)
 
     # Validate if requested
     if args.validate:
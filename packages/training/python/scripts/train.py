@@ -33,25 +33,26 @@ Model recommendations for consumer hardware:
 
 import argparse
 import asyncio
-import json
 import logging
 import os
-import random
 import subprocess
 import sys
+from collections.abc import AsyncIterator, Iterator
 from pathlib import Path
 from typing import Literal
 
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+import numpy as np
+import orjson
 from dotenv import load_dotenv
 from src.data_bridge.reader import (
     JsonTrajectoryReader,
     PostgresTrajectoryReader,
+    may_have_llm_calls,
     validate_llm_calls,
 )
-from src.models import BabylonTrajectory
 
 # Load environment
 env_path = Path(__file__).parent.parent.parent.parent.parent / ".env"
@@ -85,16 +86,27 @@ def detect_backend() -> Literal["mlx", "cuda", "cpu"]:
     return "cpu"
 
 
-async def load_postgres_data(
+def configure_torch_backends() -> None:
+    """Enable TF32 matmuls and cuDNN autotuning (free throughput on Ampere+ GPUs)."""
+    import torch
+
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    torch.backends.cudnn.benchmark = True
+    torch.set_float32_matmul_precision("high")
+
+
+async def iter_postgres_samples(
     database_url: str,
     min_actions: int,
     lookback_hours: int,
     max_trajectories: int,
-) -> list[BabylonTrajectory]:
-    """Load training data from PostgreSQL database."""
+) -> AsyncIterator[dict]:
+    """Stream training samples from PostgreSQL, one trajectory resident at a time."""
     logger.info("Loading training data from database...")
 
-    trajectories: list[BabylonTrajectory] = []
+    num_trajectories = 0
+    num_samples = 0
 
     async with PostgresTrajectoryReader(database_url) as reader:
         windows = await reader.get_window_ids(lookback_hours=lookback_hours)
@@ -104,69 +116,63 @@ async def load_postgres_data(
         logger.info(f"Found {len(windows)} trajectory windows")
 
         for window_id in windows:
-            if len(trajectories) >= max_trajectories:
+            if num_trajectories >= max_trajectories:
                 break
 
-            window_trajectories = await reader.get_trajectories_by_window(
+            async for traj_row in reader.iter_trajectories_by_window(
                 window_id, min_actions=min_actions, validate=True
-            )
-            for traj_row in window_trajectories:
-                steps = json.loads(traj_row.steps_json)
-                traj_data = {
-                    "id": traj_row.trajectory_id,
-                    "trajectory_id": traj_row.trajectory_id,
-                    "agent_id": traj_row.agent_id,
-                    "window_id": traj_row.window_id,
-                    "steps": steps,
-                    "total_reward": traj_row.total_reward,
-                    "episode_length": traj_row.episode_length,
-                    "final_status": traj_row.final_status,
-                    "final_pnl": traj_row.final_pnl,
-                    "trades_executed": traj_row.trades_executed,
-                    "archetype": traj_row.archetype,
-                }
-                trajectories.append(BabylonTrajectory.model_validate(traj_data))
-
-    if len(trajectories) < 10:
+            ):
+                if num_trajectories >= max_trajectories:
+                    break
+                num_trajectories += 1
+                for sample in steps_to_samples(traj_row.steps):
+                    num_samples += 1
+                    yield sample
+
+    if num_trajectories < 10:
         raise ValueError(
-            f"Insufficient training data: only {len(trajectories)} valid trajectories found."
+            f"Insufficient training data: only {num_trajectories} valid trajectories found."
         )
 
-    logger.info(f"Loaded {len(trajectories)} trajectories from database")
-    return trajectories
+    logger.info(
+        f"Converted {num_trajectories} database trajectories to {num_samples} training samples"
+    )
 
 
-def load_json_data(source_dir: str, max_trajectories: int) -> list[BabylonTrajectory]:
-    """Load training data from local JSON files."""
+def iter_json_samples(source_dir: str, max_trajectories: int) -> Iterator[dict]:
+    """Stream training samples from local JSON files, one trajectory at a time."""
     logger.info(f"Loading training data from: {source_dir}")
 
     reader = JsonTrajectoryReader(source_dir)
-    trajectories: list[BabylonTrajectory] = []
+    num_trajectories = 0
+    num_samples = 0
 
     for window_id in reader.get_window_ids():
-        if len(trajectories) >= max_trajectories:
+        if num_trajectories >= max_trajectories:
             break
         for traj_data in reader.get_trajectories_by_window(window_id):
             # Handle nested trajectory key and stepsJson string format
             if "trajectory" in traj_data:
                 traj_data = traj_data["trajectory"]
             if "stepsJson" in traj_data and isinstance(traj_data["stepsJson"], str):
-                traj_data["steps"] = json.loads(traj_data["stepsJson"])
+                # Skip trajectories without LLM calls before paying for the decode
+                if not may_have_llm_calls(traj_data["stepsJson"]):
+                    continue
+                traj_data["steps"] = orjson.loads(traj_data["stepsJson"])
 
-            is_valid, _ = validate_llm_calls(traj_data.get("steps", []))
+            is_valid, _ = validate_llm_calls(traj_data.get("steps", []), stop_at_first_issue=True)
             if not is_valid:
                 continue
 
-            if "id" not in traj_data:
-                traj_data["id"] = traj_data.get("trajectory_id", "id_missing")
-
-            trajectories.append(BabylonTrajectory.model_validate(traj_data))
+            num_trajectories += 1
+            for sample in steps_to_samples(traj_data.get("steps", [])):
+                num_samples += 1
+                yield sample
 
-    if len(trajectories) == 0:
+    if num_trajectories == 0:
         raise ValueError("No valid trajectories found in JSON files.")
 
-    logger.info(f"Loaded {len(trajectories)} trajectories from JSON files")
-    return trajectories
+    logger.info(f"Converted {num_trajectories} JSON trajectories to {num_samples} training samples")
 
 
 def load_csv_data(csv_path: str) -> list[dict]:
@@ -181,16 +187,21 @@ def load_csv_data(csv_path: str) -> list[dict]:
         df = df[df["score"] > 0.7].copy()
         logger.info(f"Filtered to {len(df)} high-quality samples")
 
-    samples = []
-    for _, row in df.iterrows():
-        messages = []
-        if "system" in row and pd.notna(row["system"]):
-            messages.append({"role": "system", "content": str(row["system"])})
-        if "prompt" in row and pd.notna(row["prompt"]):
-            messages.append({"role": "user", "content": str(row["prompt"])})
-        if "response" in row and pd.notna(row["response"]):
-            messages.append({"role": "assistant", "content": str(row["response"])})
+    # Convert each role column once; missing cells become NaN and are skipped below
+    role_columns = [
+        (role, df[column].astype(str).where(df[column].notna()).to_numpy())
+        for column, role in (("system", "system"), ("prompt", "user"), ("response", "assistant"))
+        if column in df.columns
+    ]
+    roles = [role for role, _ in role_columns]
 
+    samples = []
+    for row_values in zip(*(values for _, values in role_columns), strict=True):
+        messages = [
+            {"role": role, "content": content}
+            for role, content in zip(roles, row_values, strict=True)
+            if isinstance(content, str)
+        ]
         if len(messages) >= 2:
             samples.append({"messages": messages})
 
@@ -198,28 +209,37 @@ def load_csv_data(csv_path: str) -> list[dict]:
     return samples
 
 
-def trajectories_to_samples(trajectories: list[BabylonTrajectory]) -> list[dict]:
-    """Convert trajectories to training samples."""
+def steps_to_samples(steps: list[dict]) -> list[dict]:
+    """
+    Convert one trajectory's raw step dicts to training samples.
+
+    Reads the LLM call fields straight from the stored JSON (camelCase or snake_case keys)
+    instead of validating the whole trajectory into models; loaders have already run
+    validate_llm_calls on these steps.
+    """
     samples = []
-    for traj in trajectories:
-        for step in traj.steps:
-            if not step.llm_calls:
+    for step in steps:
+        llm_calls = step.get("llmCalls") or step.get("llm_calls")
+        if not llm_calls:
+            continue
+        for llm_call in llm_calls:
+            response = llm_call.get("response")
+            if not response or len(response) < 20:
                 continue
-            for llm_call in step.llm_calls:
-                if not llm_call.response or len(llm_call.response) < 20:
-                    continue
 
-                messages = []
-                if llm_call.system_prompt:
-                    messages.append({"role": "system", "content": llm_call.system_prompt})
-                if llm_call.user_prompt:
-                    messages.append({"role": "user", "content": llm_call.user_prompt})
-                messages.append({"role": "assistant", "content": llm_call.response})
+            system_prompt = llm_call.get("systemPrompt") or llm_call.get("system_prompt")
+            user_prompt = llm_call.get("userPrompt") or llm_call.get("user_prompt")
 
-                if len(messages) >= 2:
-                    samples.append({"messages": messages})
+            messages = []
+            if system_prompt:
+                messages.append({"role": "system", "content": system_prompt})
+            if user_prompt:
+                messages.append({"role": "user", "content": user_prompt})
+            messages.append({"role": "assistant", "content": response})
+
+            if len(messages) >= 2:
+                samples.append({"messages": messages})
 
-    logger.info(f"Converted {len(trajectories)} trajectories to {len(samples)} training samples")
     return samples
 
 
@@ -239,16 +259,18 @@ def train_mlx(
     data_dir = os.path.join(output_dir, "training_data")
     os.makedirs(data_dir, exist_ok=True)
 
-    random.shuffle(samples)
+    # Shuffle an index order rather than the caller's sample list
+    order = np.random.default_rng().permutation(len(samples))
     split_idx = int(len(samples) * 0.9)
-    train_samples, valid_samples = samples[:split_idx], samples[split_idx:]
 
-    with open(os.path.join(data_dir, "train.jsonl"), "w") as f:
-        for s in train_samples:
-            f.write(json.dumps(s) + "\n")
-    with open(os.path.join(data_dir, "valid.jsonl"), "w") as f:
-        for s in valid_samples:
-            f.write(json.dumps(s) + "\n")
+    with open(os.path.join(data_dir, "train.jsonl"), "wb") as f:
+        f.writelines(
+            orjson.dumps(samples[i], option=orjson.OPT_APPEND_NEWLINE) for i in order[:split_idx]
+        )
+    with open(os.path.join(data_dir, "valid.jsonl"), "wb") as f:
+        f.writelines(
+            orjson.dumps(samples[i], option=orjson.OPT_APPEND_NEWLINE) for i in order[split_idx:]
+        )
 
     adapter_path = os.path.join(output_dir, "adapters")
 
@@ -297,8 +319,11 @@ def train_cuda(
     batch_size: int,
     learning_rate: float,
     use_lora: bool,
+    compile_model: bool = False,
 ) -> str:
     """Train using PyTorch/CUDA on NVIDIA GPU."""
+    import importlib.util
+
     import torch
     from datasets import Dataset
     from transformers import (
@@ -313,34 +338,40 @@ def train_cuda(
     logger.info("CUDA/PYTORCH TRAINING")
     logger.info("=" * 60)
     logger.info(f"VRAM: {torch.cuda.get_device_properties(0).total_memory / 1e9:.1f} GB")
+    configure_torch_backends()
+
+    # The effective batch (per-device batch x accumulation steps) stays at 8 for any --batch-size
+    effective_batch_size = 8
+    if effective_batch_size % batch_size:
+        raise ValueError(f"--batch-size must divide {effective_batch_size}, got {batch_size}")
 
     tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
     if tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
 
-    formatted = [
-        {
-            "text": tokenizer.apply_chat_template(
-                s["messages"], tokenize=False, add_generation_prompt=False
-            )
-        }
-        for s in samples
-        if s.get("messages")
-    ]
-    dataset = Dataset.from_list(formatted)
-
-    def tokenize_fn(examples: dict) -> dict:
-        return tokenizer(
-            examples["text"],
-            truncation=True,
-            max_length=1024,
-            padding="max_length",
-        )
-
-    tokenized = dataset.map(tokenize_fn, batched=True, remove_columns=["text"])
-
+    # Render all conversations in one batched template call, then tokenize them in one call
+    texts = tokenizer.apply_chat_template(
+        [s["messages"] for s in samples if s.get("messages")],
+        tokenize=False,
+        add_generation_prompt=False,
+    )
+    # No padding here: the collator pads each batch to its longest sample
+    encodings = tokenizer(texts, truncation=True, max_length=1024)
+    tokenized = Dataset.from_dict(dict(encodings))
+
+    # Ampere+ GPUs train in bf16 (no loss scaling needed); older GPUs fall back to fp16
+    use_bf16 = torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+    # FlashAttention-2 when the flash_attn package is installed, PyTorch SDPA otherwise
+    attn_implementation = (
+        "flash_attention_2" if importlib.util.find_spec("flash_attn") is not None else "sdpa"
+    )
+    logger.info(f"Attention implementation: {attn_implementation}")
     model = AutoModelForCausalLM.from_pretrained(
-        model_name, torch_dtype=torch.float16, trust_remote_code=True, device_map="auto"
+        model_name,
+        torch_dtype=torch.bfloat16 if use_bf16 else torch.float16,
+        attn_implementation=attn_implementation,
+        trust_remote_code=True,
+        device_map="auto",
     )
 
     if use_lora:
@@ -356,26 +387,42 @@ def train_cuda(
         model = get_peft_model(model, lora_config)
         model.print_trainable_parameters()
 
+    # bitsandbytes 8-bit AdamW halves optimizer-state VRAM; fused PyTorch AdamW otherwise
+    optim = (
+        "adamw_bnb_8bit"
+        if importlib.util.find_spec("bitsandbytes") is not None
+        else "adamw_torch_fused"
+    )
+    logger.info(f"Optimizer: {optim}")
+
     training_args = TrainingArguments(
         output_dir=output_dir,
         num_train_epochs=epochs,
-        per_device_train_batch_size=1,
-        gradient_accumulation_steps=8,
+        per_device_train_batch_size=batch_size,
+        gradient_accumulation_steps=effective_batch_size // batch_size,
+        gradient_checkpointing=True,
+        gradient_checkpointing_kwargs={"use_reentrant": False},
+        optim=optim,
         learning_rate=learning_rate,
         warmup_steps=100,
         logging_steps=10,
         save_steps=500,
         save_total_limit=2,
-        fp16=True,
+        bf16=use_bf16,
+        fp16=not use_bf16,
         report_to="none",
         remove_unused_columns=False,
+        group_by_length=True,
+        torch_compile=compile_model,
     )
 
     trainer = Trainer(
         model=model,
         args=training_args,
         train_dataset=tokenized,
-        data_collator=DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False),
+        data_collator=DataCollatorForLanguageModeling(
+            tokenizer=tokenizer, mlm=False, pad_to_multiple_of=8
+        ),
     )
 
     trainer.train()
@@ -397,9 +444,17 @@ def train_cpu(
 
 
 def validate_model(
-    model_path: str, backend: Literal["mlx", "cuda", "cpu"], base_model: str | None = None
+    model_path: str,
+    backend: Literal["mlx", "cuda", "cpu"],
+    base_model: str | None = None,
+    draft_model: str | None = None,
+    compile_model: bool = False,
 ) -> bool:
-    """Validate trained model by generating a test response."""
+    """Validate trained model by generating a test response.
+
+    ``draft_model`` enables speculative decoding on CUDA/CPU; it must share the
+    trained model's tokenizer (e.g. Qwen2.5-0.5B drafting for Qwen2.5-1.5B).
+    """
     logger.info("=" * 60)
     logger.info("VALIDATING TRAINED MODEL")
     logger.info("=" * 60)
@@ -429,12 +484,36 @@ Analyze this market update and explain your trading decision."""
         from transformers import AutoModelForCausalLM, AutoTokenizer
 
         tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+        if backend == "cuda":
+            configure_torch_backends()
+            dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        else:
+            dtype = torch.float32
         model = AutoModelForCausalLM.from_pretrained(
             model_path,
-            torch_dtype=torch.float16 if backend == "cuda" else torch.float32,
+            torch_dtype=dtype,
             device_map="auto" if backend == "cuda" else None,
             trust_remote_code=True,
         )
+        if compile_model:
+            # generate() calls forward() per token, so compile that with a static KV cache to keep
+            # shapes fixed; the first calls are slow while graphs are captured
+            model.generation_config.cache_implementation = "static"
+            model.forward = torch.compile(
+                model.forward, mode="reduce-overhead", fullgraph=False, dynamic=False
+            )
+        speculative = {}
+        if draft_model:
+            speculative = {
+                "assistant_model": AutoModelForCausalLM.from_pretrained(
+                    draft_model,
+                    torch_dtype=dtype,
+                    device_map={"": model.device} if backend == "cuda" else None,
+                    trust_remote_code=True,
+                ),
+                "num_assistant_tokens": 5,
+                "num_assistant_tokens_schedule": "heuristic",
+            }
         messages = [{"role": "user", "content": test_prompt}]
         prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
         inputs = tokenizer(prompt, return_tensors="pt")
@@ -446,6 +525,7 @@ Analyze this market update and explain your trading decision."""
             temperature=0.7,
             do_sample=True,
             pad_token_id=tokenizer.eos_token_id,
+            **speculative,
         )
         response = tokenizer.decode(
             outputs[0][inputs["input_ids"].shape[1] :], skip_special_tokens=True
@@ -477,17 +557,18 @@ async def main_async(args: argparse.Namespace) -> int:
     if args.csv:
         samples = load_csv_data(args.csv)
     elif args.source_dir:
-        trajectories = load_json_data(args.source_dir, args.max_trajectories)
-        samples = trajectories_to_samples(trajectories)
+        samples = list(iter_json_samples(args.source_dir, args.max_trajectories))
     else:
         database_url = args.database_url or os.getenv("DATABASE_URL")
         if not database_url:
             logger.error("DATABASE_URL not set and --source-dir/--csv not provided")
             return 1
-        trajectories = await load_postgres_data(
-            database_url, args.min_actions, args.lookback_hours, args.max_trajectories
-        )
-        samples = trajectories_to_samples(trajectories)
+        samples = [
+            sample
+            async for sample in iter_postgres_samples(
+                database_url, args.min_actions, args.lookback_hours, args.max_trajectories
+            )
+        ]
 
     if len(samples) < 10:
         logger.error(f"Not enough training samples: {len(samples)}")
@@ -504,14 +585,21 @@ async def main_async(args: argparse.Namespace) -> int:
         base_model = model_name
     elif backend == "cuda":
         model_path = train_cuda(
-            samples, model_name, args.output, args.epochs, args.batch_size, args.lr, args.lora
+            samples,
+            model_name,
+            args.output,
+            args.epochs,
+            args.batch_size,
+            args.lr,
+            args.lora,
+            args.compile,
         )
     else:
         model_path = train_cpu(samples, model_name, args.output, args.epochs, args.lr)
 
     # Validate
     if args.validate and model_path:
-        validate_model(model_path, backend, base_model)
+        validate_model(model_path, backend, base_model, args.draft_model, args.compile)
 
     logger.info("=" * 60)
     logger.info("TRAINING COMPLETE")
@@ -563,6 +651,15 @@ def main() -> int:
         default=True,
         help="Validate trained model",
     )
+    parser.add_argument(
+        "--draft-model",
+        help="Draft model for speculative decoding during validation (CUDA/CPU only)",
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="torch.compile the model for CUDA training and CUDA/CPU validation",
+    )
 
     args = parser.parse_args()
     return asyncio.run(main_async(args))
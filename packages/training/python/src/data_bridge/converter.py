@@ -7,16 +7,62 @@ Integrates 'The Judge' (Reward Functions) to score trajectories during conversio
 """
 
 import json
-import random
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
+from functools import lru_cache
+from itertools import islice, repeat
+
+import numpy as np
+from typing_extensions import Self
 
 from ..models import AtroposScoredGroup as PydanticScoredGroup
 from ..models import BabylonTrajectory, MarketOutcomes
 from ..training.quality_utils import calculate_detailed_tick_quality
-from ..training.rewards import TrajectoryRewardInputs, calculate_risk_reward, composite_reward
+from ..training.rewards import (
+    TrajectoryRewardInputs,
+    calculate_risk_reward_batch,
+    composite_reward,
+)
+
+# Chat templates that wrap assistant turns in {% generation %} can report assistant tokens directly
+_GENERATION_BLOCK_RE = re.compile(r"\{%-?\s*generation\s*-?%\}")
+
+
+def _supports_assistant_mask(tokenizer) -> bool:
+    """Check whether the tokenizer's chat template marks assistant spans for masking."""
+    chat_template = getattr(tokenizer, "chat_template", None)
+    return isinstance(chat_template, str) and bool(_GENERATION_BLOCK_RE.search(chat_template))
+
+
+@lru_cache(maxsize=64)
+def _role_template_overhead(tokenizer, role: str) -> int:
+    """Tokens the chat template adds around a single message with the given role."""
+    return len(
+        tokenizer.apply_chat_template(
+            [{"role": role, "content": ""}],
+            tokenize=True,
+            add_generation_prompt=False,
+            return_dict=False,
+        )
+    )
 
 
-@dataclass
+@lru_cache(maxsize=4096)
+def _message_token_length(tokenizer, role: str, content: str) -> int:
+    """
+    Token length of one message rendered alone through the chat template.
+
+    Measured as the role's template overhead plus the plain tokenization of the
+    content, so only one template render happens per role. Cached because
+    trajectories in a window share system messages and often prompts.
+    """
+    content_ids = tokenizer(content, add_special_tokens=False)["input_ids"]
+    return _role_template_overhead(tokenizer, role) + len(content_ids)
+
+
+@dataclass(slots=True)
 class AtroposMessage:
     """Single message in a conversation."""
 
@@ -28,14 +74,15 @@ class AtroposMessage:
         return {"role": self.role, "content": self.content}
 
 
-@dataclass
+@dataclass(slots=True)
 class AtroposTrajectory:
     """Trajectory in Atropos format."""
 
     messages: list[AtroposMessage]
     tokens: list[int] = field(default_factory=list)
     masks: list[int] = field(default_factory=list)
-    logprobs: list[float] = field(default_factory=list)
+    # None until inference logprobs are attached; filled in at the group boundary
+    logprobs: list[float] | None = None
     score: float = 0.0
     metadata: dict = field(default_factory=dict)
 
@@ -44,7 +91,7 @@ class AtroposTrajectory:
         return [m.to_dict() for m in self.messages]
 
 
-@dataclass
+@dataclass(slots=True)
 class ScoredGroupResult:
     """Scored group for GRPO training."""
 
@@ -59,6 +106,22 @@ class ScoredGroupResult:
         """Number of trajectories in group."""
         return len(self.tokens)
 
+    def to_padded_arrays(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Pack tokens and masks into contiguous right-padded arrays.
+
+        Returns:
+            Tuple of (tokens, masks, lengths); tokens pad with 0 and masks with -100
+        """
+        lengths = np.fromiter((len(t) for t in self.tokens), dtype=np.int64, count=self.group_size)
+        max_len = int(lengths.max()) if self.group_size else 0
+        tokens = np.zeros((self.group_size, max_len), dtype=np.int64)
+        masks = np.full((self.group_size, max_len), -100, dtype=np.int64)
+        for row, (row_tokens, row_masks) in enumerate(zip(self.tokens, self.masks, strict=True)):
+            tokens[row, : len(row_tokens)] = row_tokens
+            masks[row, : len(row_masks)] = row_masks
+        return tokens, masks, lengths
+
     def to_pydantic(self) -> PydanticScoredGroup:
         """Convert to Pydantic model."""
         return PydanticScoredGroup(
@@ -78,6 +141,7 @@ class BabylonToAtroposConverter:
         dropout_rate: Random dropout rate for data augmentation (0.0-0.5)
         max_steps: Maximum steps to include per trajectory
         include_messages: Whether to include raw messages in output
+        seed: Seed for the generator behind dropout and group sampling
     """
 
     def __init__(
@@ -85,18 +149,41 @@ class BabylonToAtroposConverter:
         dropout_rate: float = 0.0,
         max_steps: int = 20,
         include_messages: bool = True,
+        seed: int | None = None,
     ):
         if not 0.0 <= dropout_rate <= 0.5:
             raise ValueError(f"dropout_rate must be 0.0-0.5, got {dropout_rate}")
         self.dropout_rate = dropout_rate
         self.max_steps = max_steps
         self.include_messages = include_messages
+        self._rng = np.random.default_rng(seed)
+        # Created on first tokenized group; fast tokenizers release the GIL while encoding
+        self._executor: ThreadPoolExecutor | None = None
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_val: BaseException | None,
+        exc_tb: object,
+    ) -> None:
+        """Shut down the conversion thread pool upon exiting the context."""
+        self.close()
+
+    def close(self) -> None:
+        """Shut down the conversion thread pool, if one was started."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
 
     def convert_trajectory(
         self,
         babylon_traj: BabylonTrajectory,
         market_outcomes: MarketOutcomes | None = None,
         tokenizer=None,
+        outcomes_text: str | None = None,
     ) -> AtroposTrajectory | None:
         """
         Convert a Babylon trajectory to Atropos format.
@@ -106,6 +193,7 @@ class BabylonToAtroposConverter:
             babylon_traj: Source trajectory
             market_outcomes: Optional market outcome data for context
             tokenizer: Optional tokenizer for token mask computation
+            outcomes_text: Pre-rendered market outcomes section, shared across a window
 
         Returns:
             Converted trajectory, or None if dropped
@@ -114,26 +202,34 @@ class BabylonToAtroposConverter:
             ValueError: If trajectory has insufficient messages
         """
         # Random dropout for data augmentation
-        if self.dropout_rate > 0 and random.random() < self.dropout_rate:
+        if self.dropout_rate > 0 and self._rng.random() < self.dropout_rate:
             return None
 
+        return self._convert_trajectory(babylon_traj, market_outcomes, tokenizer, outcomes_text)
+
+    def _convert_trajectory(
+        self,
+        babylon_traj: BabylonTrajectory,
+        market_outcomes: MarketOutcomes | None,
+        tokenizer,
+        outcomes_text: str | None,
+    ) -> AtroposTrajectory:
+        """Convert one trajectory that survived dropout; safe to run on worker threads."""
         messages: list[AtroposMessage] = []
 
         # System message with context
-        system_msg = self._build_system_message(babylon_traj, market_outcomes)
+        system_msg = self._build_system_message(babylon_traj, market_outcomes, outcomes_text)
         messages.append(AtroposMessage(role="system", content=system_msg))
 
-        # Convert steps to messages
-        steps = (
-            babylon_traj.steps[-self.max_steps :]
-            if len(babylon_traj.steps) > self.max_steps
-            else babylon_traj.steps
-        )
+        # Convert the last max_steps steps to messages without copying the tail
+        steps = islice(babylon_traj.steps, max(0, len(babylon_traj.steps) - self.max_steps), None)
 
         total_format_score = 0.0
         total_reasoning_score = 0.0
-        risky_actions_count = 0
         valid_ticks_for_scoring = 0
+        # Risk inputs for scored ticks, evaluated together after the loop
+        scored_open_positions: list[int] = []
+        scored_action_types: list[str] = []
 
         for step in steps:
             # 1. Message Generation
@@ -176,15 +272,16 @@ class BabylonToAtroposConverter:
                 total_format_score += fmt_score
                 total_reasoning_score += rsn_score
 
-                # B. Risk Calculation
-                # Use open_positions as a rough proxy for exposure if active_markets is available
-                # Assuming ~10% exposure per position for simulation logic
-                exposure_proxy = min(1.0, step.environment_state.open_positions * 0.1)
+                # B. Risk inputs
+                scored_open_positions.append(step.environment_state.open_positions)
+                scored_action_types.append(step.action.action_type if step.action else "wait")
 
-                act_type = step.action.action_type if step.action else "wait"
-                risk_penalty = calculate_risk_reward(exposure_proxy, act_type)
-                if risk_penalty < 0:
-                    risky_actions_count += 1
+        # Risk Calculation
+        # Use open_positions as a rough proxy for exposure if active_markets is available
+        # Assuming ~10% exposure per position for simulation logic
+        exposure_proxy = np.minimum(1.0, np.asarray(scored_open_positions, dtype=np.float64) * 0.1)
+        risk_penalties = calculate_risk_reward_batch(exposure_proxy, scored_action_types)
+        risky_actions_count = int((risk_penalties < 0).sum())
 
         if len(messages) < 3:
             # We assume at least System + User + Assistant
@@ -231,17 +328,28 @@ class BabylonToAtroposConverter:
 
         if tokenizer is not None:
             messages_dict = [m.to_dict() for m in messages]
-            tokenized = tokenizer.apply_chat_template(
-                messages_dict, tokenize=True, return_dict=True
-            )
-            tokens = tokenized.get("input_ids", [])
-            masks = self._create_masks(tokens, messages, tokenizer)
+            if _supports_assistant_mask(tokenizer):
+                # One render yields both tokens and assistant spans
+                tokenized = tokenizer.apply_chat_template(
+                    messages_dict,
+                    tokenize=True,
+                    return_dict=True,
+                    return_assistant_tokens_mask=True,
+                )
+                tokens = tokenized.get("input_ids", [])
+                is_assistant = np.asarray(tokenized["assistant_masks"], dtype=bool)
+                masks = np.where(is_assistant, np.asarray(tokens, dtype=np.int64), -100).tolist()
+            else:
+                tokenized = tokenizer.apply_chat_template(
+                    messages_dict, tokenize=True, return_dict=True
+                )
+                tokens = tokenized.get("input_ids", [])
+                masks = self._create_masks(tokens, messages, tokenizer)
 
         return AtroposTrajectory(
             messages=messages,
             tokens=tokens,
             masks=masks,
-            logprobs=[],
             score=final_score,
             metadata={
                 "trajectory_id": babylon_traj.trajectory_id,
@@ -266,6 +374,7 @@ class BabylonToAtroposConverter:
         """
         Create training mask marking assistant tokens as trainable.
 
+        Fallback for chat templates without {% generation %} markers.
         Uses simple role-based segmentation. Marks -100 for non-trainable,
         token_id for trainable tokens.
 
@@ -277,7 +386,7 @@ class BabylonToAtroposConverter:
         Returns:
             Mask list with same length as tokens
         """
-        masks = [-100] * len(tokens)
+        is_assistant = np.zeros(len(tokens), dtype=bool)
 
         # Simple approach: tokenize each message and find assistant segments
         current_pos = 0
@@ -287,47 +396,57 @@ class BabylonToAtroposConverter:
             current_pos = 1
 
         for msg in messages:
-            msg_tokens = tokenizer.apply_chat_template(
-                [msg.to_dict()], tokenize=True, add_generation_prompt=False
-            )
-            msg_len = len(msg_tokens)
+            msg_len = _message_token_length(tokenizer, msg.role, msg.content)
 
             if has_bos and msg_len > 0:
                 msg_len -= 1
 
             if msg.role == "assistant":
-                for i in range(current_pos, min(current_pos + msg_len, len(tokens))):
-                    masks[i] = tokens[i]
+                # Slicing clips at the end of the sequence
+                is_assistant[current_pos : current_pos + msg_len] = True
 
             current_pos += msg_len
 
-        return masks
+        return np.where(is_assistant, np.asarray(tokens, dtype=np.int64), -100).tolist()
 
     def _build_system_message(
         self,
         trajectory: BabylonTrajectory,
         market_outcomes: MarketOutcomes | None,
+        outcomes_text: str | None = None,
     ) -> str:
         """Build system message with ground truth context."""
-        msg = f"""You are evaluating trading agent decisions.
+        if outcomes_text is None:
+            outcomes_text = self._render_market_outcomes(market_outcomes)
+
+        return "".join(
+            (
+                "You are evaluating trading agent decisions.\n\n",
+                f"AGENT: {trajectory.agent_id}\n",
+                f"TIME WINDOW: {trajectory.window_id}\n",
+                outcomes_text,
+                "\n\nEvaluate this agent's decisions given the outcomes.",
+            )
+        )
 
-AGENT: {trajectory.agent_id}
-TIME WINDOW: {trajectory.window_id}
-"""
+    def _render_market_outcomes(self, market_outcomes: MarketOutcomes | None) -> str:
+        """Render the market outcomes section shared by every trajectory in a window."""
+        if not market_outcomes or not market_outcomes.stocks:
+            return ""
 
-        if market_outcomes and market_outcomes.stocks:
-            msg += "\nMARKET OUTCOMES (ground truth agent didn't know):\n"
+        parts = ["\nMARKET OUTCOMES (ground truth agent didn't know):\n"]
 
-            for ticker, outcome in market_outcomes.stocks.items():
-                msg += f"\n{ticker}:"
-                msg += f"\n  Price: ${outcome.start_price:.2f} → ${outcome.end_price:.2f} ({outcome.change_percent:+.1f}%)"
-                msg += f"\n  Sentiment: {outcome.sentiment or 'UNKNOWN'}"
+        for ticker, outcome in market_outcomes.stocks.items():
+            parts.append(f"\n{ticker}:")
+            parts.append(
+                f"\n  Price: ${outcome.start_price:.2f} → ${outcome.end_price:.2f} ({outcome.change_percent:+.1f}%)"
+            )
+            parts.append(f"\n  Sentiment: {outcome.sentiment or 'UNKNOWN'}")
 
-                if outcome.news_events:
-                    msg += f"\n  News: {outcome.news_events[0]}"
+            if outcome.news_events:
+                parts.append(f"\n  News: {outcome.news_events[0]}")
 
-        msg += "\n\nEvaluate this agent's decisions given the outcomes."
-        return msg
+        return "".join(parts)
 
     def convert_window_group(
         self,
@@ -358,7 +477,7 @@ TIME WINDOW: {trajectory.window_id}
 
         # Sample if too many
         if len(trajectories) > max_per_group:
-            indices = random.sample(range(len(trajectories)), max_per_group)
+            indices = self._rng.choice(len(trajectories), size=max_per_group, replace=False)
             sampled = [trajectories[i] for i in indices]
             # Note: We ignore incoming 'scores' list if we are calculating them internally via The Judge
             # However, if scores were passed in, we filter them to match sample
@@ -367,12 +486,34 @@ TIME WINDOW: {trajectory.window_id}
         else:
             sampled = trajectories
 
-        # Convert all
-        atropos_trajectories: list[AtroposTrajectory] = []
-        for traj in sampled:
-            converted = self.convert_trajectory(traj, market_outcomes, tokenizer)
-            if converted:
-                atropos_trajectories.append(converted)
+        # Draw dropout for the whole group here, in order, so a seeded run does not
+        # depend on how worker threads are scheduled
+        if self.dropout_rate > 0:
+            draws = self._rng.random(len(sampled))
+            sampled = [t for t, d in zip(sampled, draws, strict=True) if d >= self.dropout_rate]
+
+        # Every trajectory in the window shares the same outcomes section
+        outcomes_text = self._render_market_outcomes(market_outcomes)
+
+        # Convert all, overlapping tokenization across threads when the tokenizer is Rust-backed
+        atropos_trajectories: list[AtroposTrajectory]
+        if getattr(tokenizer, "is_fast", False) and len(sampled) > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
+            atropos_trajectories = list(
+                self._executor.map(
+                    self._convert_trajectory,
+                    sampled,
+                    repeat(market_outcomes),
+                    repeat(tokenizer),
+                    repeat(outcomes_text),
+                )
+            )
+        else:
+            atropos_trajectories = [
+                self._convert_trajectory(traj, market_outcomes, tokenizer, outcomes_text)
+                for traj in sampled
+            ]
 
         if len(atropos_trajectories) < 2:
             raise ValueError(
@@ -382,7 +523,7 @@ TIME WINDOW: {trajectory.window_id}
         # Build result
         tokens_list = [t.tokens for t in atropos_trajectories]
         masks_list = [t.masks for t in atropos_trajectories]
-        logprobs_list = [t.logprobs for t in atropos_trajectories]
+        logprobs_list = [t.logprobs or [] for t in atropos_trajectories]
 
         # Use the internally calculated scores from The Judge
         scores_list = [t.score for t in atropos_trajectories]
@@ -401,24 +542,30 @@ TIME WINDOW: {trajectory.window_id}
 
 
 def calculate_dropout_rate(
-    current_trajectories: int, target_trajectories: int, max_dropout: float = 0.3
-) -> float:
+    current_trajectories: int | np.ndarray,
+    target_trajectories: int,
+    max_dropout: float | np.ndarray = 0.3,
+) -> float | np.ndarray:
     """
     Calculate the dropout rate required to reduce the number of trajectories
     from the current count to the target count.
 
     Args:
-        current_trajectories: The number of trajectories currently available.
+        current_trajectories: The number of trajectories currently available,
+            or an array of counts.
         target_trajectories: The desired number of trajectories.
-        max_dropout: The maximum allowable dropout rate (0.0 to 1.0).
+        max_dropout: The maximum allowable dropout rate (0.0 to 1.0); broadcast
+            against current_trajectories.
 
     Returns:
-        The calculated dropout rate, capped by max_dropout.
+        The calculated dropout rate, capped by max_dropout. A float for scalar
+        inputs, an array of rates for array inputs.
     """
-    if current_trajectories <= target_trajectories:
-        return 0.0
+    current = np.asarray(current_trajectories, dtype=np.float64)
+    needs_dropout = current > target_trajectories
 
-    # Dropout rate = 1 - (target / current)
-    rate = 1.0 - (float(target_trajectories) / current_trajectories)
+    # Dropout rate = 1 - (target / current); the ratio stays 1 (rate 0) where none is needed
+    ratio = np.divide(target_trajectories, current, out=np.ones_like(current), where=needs_dropout)
+    rate = np.where(needs_dropout, np.minimum(1.0 - ratio, max_dropout), 0.0)
 
-    return min(rate, max_dropout)
+    return float(rate) if rate.ndim == 0 else rate
@@ -8,8 +8,12 @@ Validates LLM call quality to ensure training data authenticity.
 import json
 import logging
 import os
+import uuid
+from collections.abc import AsyncIterator
+from functools import cached_property
 from pathlib import Path
 
+import orjson
 from pydantic import BaseModel, field_validator
 from typing_extensions import Self
 
@@ -41,6 +45,11 @@ class TrajectoryRow(BaseModel):
     ai_judge_reward: float | None = None
     archetype: str | None = None
 
+    @cached_property
+    def steps(self) -> list:
+        """Decoded steps_json, parsed once and shared by validation and sample conversion."""
+        return orjson.loads(self.steps_json)
+
     @field_validator("total_reward", mode="before")
     @classmethod
     def coerce_total_reward(cls, v):
@@ -93,7 +102,19 @@ def get_connection():
     return psycopg2.connect(database_url)
 
 
-def validate_llm_calls(steps: list, min_steps_with_llm: int = 3) -> tuple[bool, list[str]]:
+def may_have_llm_calls(steps_json: str) -> bool:
+    """
+    Cheap pre-check on raw stepsJson before decoding it.
+
+    A trajectory whose JSON never mentions an LLM calls key cannot pass
+    validate_llm_calls, so callers can skip it without parsing.
+    """
+    return '"llmCalls"' in steps_json or '"llm_calls"' in steps_json
+
+
+def validate_llm_calls(
+    steps: list, min_steps_with_llm: int = 3, stop_at_first_issue: bool = False
+) -> tuple[bool, list[str]]:
     """
     Validate trajectory steps contain real LLM calls.
 
@@ -103,6 +124,8 @@ def validate_llm_calls(steps: list, min_steps_with_llm: int = 3) -> tuple[bool,
     Args:
         steps: List of trajectory steps
         min_steps_with_llm: Minimum steps with valid LLM calls
+        stop_at_first_issue: Return as soon as one issue is found, for callers that only
+            need the verdict (any issue already makes the trajectory invalid)
 
     Returns:
         Tuple of (is_valid, list of issue descriptions)
@@ -137,6 +160,8 @@ def validate_llm_calls(steps: list, min_steps_with_llm: int = 3) -> tuple[bool,
                 valid_calls_in_step += 1
             else:
                 issues.append(f"Step {i}, Call {call_idx}: " + ", ".join(call_issues))
+                if stop_at_first_issue:
+                    return False, issues
 
         if valid_calls_in_step > 0:
             steps_with_llm += 1
@@ -209,54 +234,80 @@ class PostgresTrajectoryReader:
         validate: bool = True,
         min_actions: int = 1,
     ) -> list[TrajectoryRow]:
+        return [
+            trajectory
+            async for trajectory in self.iter_trajectories_by_window(
+                window_id, min_score=min_score, validate=validate, min_actions=min_actions
+            )
+        ]
+
+    async def iter_trajectories_by_window(
+        self,
+        window_id: str,
+        min_score: float | None = None,
+        validate: bool = True,
+        min_actions: int = 1,
+        batch_size: int = 64,
+    ) -> AsyncIterator[TrajectoryRow]:
+        """
+        Stream a window's trajectories through a server-side cursor.
+
+        Rows are fetched ``batch_size`` at a time, so only one batch of stepsJson
+        blobs is resident regardless of window size.
+        """
         if not self.conn:
             raise ConnectionError("Database not connected.")
-        with self.conn.cursor() as cur:
-            query = """
-                SELECT "trajectoryId", "agentId", "windowId", "stepsJson", "metricsJson", "metadataJson",
-                       "totalReward", "episodeLength", "finalStatus", "finalPnL", "tradesExecuted",
-                       "aiJudgeReward", "archetype"
-                FROM trajectories WHERE "windowId" = %s AND "isTrainingData" = true AND "episodeLength" >= %s
-            """
-            params: list = [window_id, min_actions]
-            if min_score is not None:
-                query += ' AND "aiJudgeReward" >= %s'
-                params.append(min_score)
+        query = """
+            SELECT "trajectoryId", "agentId", "windowId", "stepsJson", "metricsJson", "metadataJson",
+                   "totalReward", "episodeLength", "finalStatus", "finalPnL", "tradesExecuted",
+                   "aiJudgeReward", "archetype"
+            FROM trajectories WHERE "windowId" = %s AND "isTrainingData" = true AND "episodeLength" >= %s
+        """
+        params: list = [window_id, min_actions]
+        if min_score is not None:
+            query += ' AND "aiJudgeReward" >= %s'
+            params.append(min_score)
+
+        # Named cursors are server-side; a unique name lets abandoned iterators coexist
+        with self.conn.cursor(name=f"trajectories_{uuid.uuid4().hex}") as cur:
+            cur.itersize = batch_size
             cur.execute(query, tuple(params))
-            rows = cur.fetchall()
-
-        results = []
-        for row in rows:
-            # Pydantic validators handle None coercion
-            trajectory = TrajectoryRow(
-                trajectory_id=row[0],
-                agent_id=row[1],
-                window_id=row[2],
-                steps_json=row[3],
-                metrics_json=row[4],
-                metadata_json=row[5],
-                total_reward=row[6],
-                episode_length=row[7],
-                final_status=row[8],
-                final_pnl=row[9],
-                trades_executed=row[10],
-                ai_judge_reward=row[11],
-                archetype=row[12],
-            )
-            if validate:
-                try:
-                    steps = json.loads(trajectory.steps_json)
-                    is_valid, issues = validate_llm_calls(steps)
-                    if not is_valid:
-                        logger.debug(f"Skipping DB trajectory {trajectory.trajectory_id}: {issues}")
+            for row in cur:
+                # Pydantic validators handle None coercion
+                trajectory = TrajectoryRow(
+                    trajectory_id=row[0],
+                    agent_id=row[1],
+                    window_id=row[2],
+                    steps_json=row[3],
+                    metrics_json=row[4],
+                    metadata_json=row[5],
+                    total_reward=row[6],
+                    episode_length=row[7],
+                    final_status=row[8],
+                    final_pnl=row[9],
+                    trades_executed=row[10],
+                    ai_judge_reward=row[11],
+                    archetype=row[12],
+                )
+                if validate:
+                    if not may_have_llm_calls(trajectory.steps_json):
+                        logger.debug(
+                            f"Skipping DB trajectory {trajectory.trajectory_id}: no LLM calls"
+                        )
                         continue
-                except (json.JSONDecodeError, TypeError):
-                    logger.warning(
-                        f"Could not parse steps_json for trajectory {trajectory.trajectory_id}"
-                    )
-                    continue
-            results.append(trajectory)
-        return results
+                    try:
+                        is_valid, issues = validate_llm_calls(trajectory.steps)
+                        if not is_valid:
+                            logger.debug(
+                                f"Skipping DB trajectory {trajectory.trajectory_id}: {issues}"
+                            )
+                            continue
+                    except (json.JSONDecodeError, TypeError):
+                        logger.warning(
+                            f"Could not parse steps_json for trajectory {trajectory.trajectory_id}"
+                        )
+                        continue
+                yield trajectory
 
 
 class JsonTrajectoryReader:
@@ -372,8 +423,9 @@ def get_trajectories_by_window(
             archetype=row[12],
         )
         if validate:
-            steps = json.loads(trajectory.steps_json)
-            is_valid, _ = validate_llm_calls(steps)
+            if not may_have_llm_calls(trajectory.steps_json):
+                continue
+            is_valid, _ = validate_llm_calls(trajectory.steps, stop_at_first_issue=True)
             if not is_valid:
                 continue
         results.append(trajectory)
@@ -20,15 +20,18 @@ This package provides training infrastructure:
 See README.md for usage instructions.
 """
 
-# Import non-torch modules directly
-# Archetype training configuration (no torch dependency)
+import importlib
+from typing import TYPE_CHECKING
+
+# Light modules (no torch, atroposlib or database driver) are imported eagerly
+# Archetype training configuration
 from .archetype_trainer import (
     ArchetypeTrainer,
     ArchetypeTrainingConfig,
     ArchetypeTrainingResult,
 )
 
-# Multi-prompt dataset (no torch dependency)
+# Multi-prompt dataset
 from .multi_prompt_dataset import (
     MultiPromptDatasetBuilder,
     PromptDataset,
@@ -39,7 +42,7 @@ from .multi_prompt_dataset import (
     validate_trajectory_for_training,
 )
 
-# Quality utilities (no torch dependency)
+# Quality utilities
 from .quality_utils import (
     ValidationResult,
     build_trajectory_from_ticks,
@@ -54,6 +57,7 @@ from .rewards import (
     RewardNormalizer,
     action_quality_reward,
     composite_reward,
+    composite_reward_batch,
     efficiency_reward,
     pairwise_preferences_to_scores,
     pnl_reward,
@@ -62,6 +66,16 @@ from .rewards import (
     risk_adjusted_reward,
 )
 
+# Rollout generation
+from .rollout_generator import (
+    AgentRunner,
+    AgentTickData,
+    FastRolloutGenerator,
+    RolloutConfig,
+    RolloutQualityValidator,
+    RolloutResult,
+)
+
 # Rubric loading from config/rubrics.json (single source of truth)
 from .rubric_loader import (
     DEFAULT_RUBRIC,
@@ -71,7 +85,7 @@ from .rubric_loader import (
     reload_rubrics,
 )
 
-# Tick reward attribution (no torch dependency)
+# Tick reward attribution
 from .tick_reward_attribution import (
     CallPurpose,
     LLMCallRecord,
@@ -82,67 +96,36 @@ from .tick_reward_attribution import (
     group_samples_for_grpo,
 )
 
+if TYPE_CHECKING:
+    from .atropos_trainer import AtroposTrainingConfig, BabylonAtroposTrainer
+    from .babylon_env import BabylonEnvConfig, BabylonRLAIFEnv
+    from .fast_simulator import FastSimulator, GameState, SimulatorConfig, SimulatorMetrics
+
+# Public name -> defining submodule for the heavy modules, imported on first access
+_LAZY_MAP = {
+    # Atropos trainer (torch)
+    "AtroposTrainingConfig": ".atropos_trainer",
+    "BabylonAtroposTrainer": ".atropos_trainer",
+    # RLAIF environment (atroposlib, openai, asyncpg)
+    "BabylonEnvConfig": ".babylon_env",
+    "BabylonRLAIFEnv": ".babylon_env",
+    # Simulator (asyncpg)
+    "FastSimulator": ".fast_simulator",
+    "GameState": ".fast_simulator",
+    "SimulatorConfig": ".fast_simulator",
+    "SimulatorMetrics": ".fast_simulator",
+}
+
 
-# Lazy imports for torch-dependent modules
 def __getattr__(name: str):
-    """Lazy import for torch-dependent modules."""
-    if name in (
-        "BabylonAtroposTrainer",
-        "AtroposTrainingConfig",
-    ):
-        from .atropos_trainer import (
-            AtroposTrainingConfig,
-            BabylonAtroposTrainer,
-        )
-
-        return locals()[name]
-
-    if name in (
-        "BabylonRLAIFEnv",
-        "BabylonEnvConfig",
-    ):
-        from .babylon_env import (
-            BabylonEnvConfig,
-            BabylonRLAIFEnv,
-        )
-
-        return locals()[name]
-
-    if name in (
-        "FastRolloutGenerator",
-        "RolloutConfig",
-        "RolloutResult",
-        "AgentTickData",
-        "RolloutQualityValidator",
-        "AgentRunner",
-    ):
-        from .rollout_generator import (
-            AgentRunner,
-            AgentTickData,
-            FastRolloutGenerator,
-            RolloutConfig,
-            RolloutQualityValidator,
-            RolloutResult,
-        )
-
-        return locals()[name]
-
-    if name in (
-        "FastSimulator",
-        "SimulatorConfig",
-        "SimulatorMetrics",
-        "GameState",
-    ):
-        from .fast_simulator import (
-            FastSimulator,
-            GameState,
-            SimulatorConfig,
-            SimulatorMetrics,
-        )
-
-        return locals()[name]
-
-    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    """Import the defining heavy submodule on first access and cache the attribute."""
+    module_name = _LAZY_MAP.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
 
 
 __all__ = [
@@ -182,6 +165,7 @@ __all__ = [
     "calculate_tick_quality_score",
     "calculate_trajectory_quality_score",
     "composite_reward",
+    "composite_reward_batch",
     "efficiency_reward",
     "get_available_archetypes",
     "get_priority_metrics",
@@ -22,8 +22,10 @@ import os
 import shutil
 import subprocess
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import Literal
 
 import numpy as np
 import requests
@@ -86,6 +88,16 @@ class AtroposTrainingConfig(BaseModel):
     gradient_accumulation_steps: int = Field(default=8, description="Gradient accumulation steps")
     seq_len: int = Field(default=4096, description="Maximum sequence length")
     max_grad_norm: float = Field(default=1.0, description="Gradient clipping norm")
+    optimizer: Literal["adamw", "paged_adamw_8bit"] = Field(
+        default="adamw",
+        description="adamw (fused on CUDA) or bitsandbytes paged 8-bit AdamW when VRAM-bound",
+    )
+    gradient_checkpointing: bool = Field(
+        default=True, description="Recompute activations in backward to save memory"
+    )
+    compile_model: bool = Field(
+        default=False, description="Compile the policy forward with torch.compile"
+    )
 
     # Device settings
     device: str = Field(
@@ -132,29 +144,60 @@ class BabylonAtroposTrainer:
         self.config = config
         self.model: AutoModelForCausalLM | None = None
         self.tokenizer: AutoTokenizer | None = None
-        self.optimizer: AdamW | None = None
+        self.optimizer: torch.optim.Optimizer | None = None
         self.current_step: int = 0
         self.vllm_process: subprocess.Popen | None = None
         self.run_id: str = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        # Keep-alive session shared by the Atropos API and vLLM health checks
+        self.session = requests.Session()
+        # Single worker so checkpoint writes land on disk in submission order
+        self._checkpoint_executor = ThreadPoolExecutor(max_workers=1)
 
     def setup(self):
         """Initialize model, tokenizer, and optimizer"""
         logger.info(f"Loading model: {self.config.model_name}")
 
+        if self.config.device.startswith("cuda"):
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.backends.cudnn.allow_tf32 = True
+            torch.backends.cudnn.benchmark = True
+
         self.tokenizer = AutoTokenizer.from_pretrained(
             self.config.model_name, trust_remote_code=True
         )
 
         self.model = AutoModelForCausalLM.from_pretrained(
-            self.config.model_name, torch_dtype=torch.bfloat16, trust_remote_code=True
+            self.config.model_name,
+            torch_dtype=torch.bfloat16,
+            attn_implementation="sdpa",
+            trust_remote_code=True,
         )
 
         assert self.model is not None, "Failed to load model"
         self.model.to(self.config.device)
-        self.model.gradient_checkpointing_enable()
+        if self.config.gradient_checkpointing:
+            self.model.gradient_checkpointing_enable(
+                gradient_checkpointing_kwargs={"use_reentrant": False}
+            )
         self.model.train()
 
-        self.optimizer = AdamW(self.model.parameters(), lr=self.config.learning_rate)
+        if self.config.compile_model:
+            # In-place compile keeps state_dict keys intact for save_pretrained.
+            # Sequence lengths vary per batch (padded to multiples of 64), so mark them dynamic.
+            self.model.compile(dynamic=True)
+
+        if self.config.optimizer == "paged_adamw_8bit":
+            import bitsandbytes as bnb
+
+            self.optimizer = bnb.optim.PagedAdamW8bit(
+                self.model.parameters(), lr=self.config.learning_rate
+            )
+        else:
+            self.optimizer = AdamW(
+                self.model.parameters(),
+                lr=self.config.learning_rate,
+                fused=self.config.device.startswith("cuda"),
+            )
 
         logger.info(f"Model loaded on {self.config.device}")
 
@@ -182,7 +225,7 @@ class BabylonAtroposTrainer:
         """Register trainer with Atropos API"""
         logger.info(f"Registering with Atropos API at {self.config.api_url}")
 
-        response = requests.post(
+        response = self.session.post(
             f"{self.config.api_url}/register",
             json={
                 "run_id": self.run_id,
@@ -204,7 +247,7 @@ class BabylonAtroposTrainer:
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10))
     def get_batch(self) -> list | None:
         """Get next batch from Atropos API"""
-        response = requests.get(f"{self.config.api_url}/batch", timeout=30)
+        response = self.session.get(f"{self.config.api_url}/batch", timeout=30)
         response.raise_for_status()
 
         data = response.json()
@@ -276,7 +319,7 @@ class BabylonAtroposTrainer:
                 raise RuntimeError(f"vLLM process died with code {self.vllm_process.returncode}")
 
             try:
-                response = requests.get(vllm_url, timeout=5)
+                response = self.session.get(vllm_url, timeout=5)
                 if response.status_code == 200:
                     logger.info("vLLM server is ready!")
                     return
@@ -309,39 +352,21 @@ class BabylonAtroposTrainer:
         if (max_token_len - 1) % good_multiple != 0:
             max_token_len = math.ceil((max_token_len - 1) / good_multiple) * good_multiple + 1
 
-        input_ids_list = []
-        labels_list = []
+        advantages_by_group = self._group_normalized_scores(batch_data)
+
+        token_rows = []
+        mask_rows = []
         advantages_list = []
         temperatures_list = []
 
-        for item in batch_data:
-            scores = np.array(item.get("scores", [0.0]))
-
-            # Normalize scores within group
-            if len(scores) > 1:
-                scores = scores - scores.mean()
-                std = scores.std()
-                if std > 1e-8:
-                    scores = scores / std
-
+        for item, scores in zip(batch_data, advantages_by_group, strict=True):
             tokens_list = item.get("tokens", [])
             masks_list = item.get("masks", [])
 
             for i in range(len(tokens_list)):
-                tokens = np.array(tokens_list[i])
-                masks = np.array(masks_list[i])
-                score = scores[i] if i < len(scores) else 0.0
-
-                # Pad tokens and masks
-                pad_length = max(0, max_token_len - len(tokens))
-
-                padded_tokens = np.concatenate([tokens, np.zeros(pad_length, dtype=np.int32)])
-                padded_masks = np.concatenate([masks, np.full(pad_length, -100, dtype=np.int32)])
-
-                # Create input_ids (all but last) and labels (all but first, shifted)
-                input_ids_list.append(padded_tokens[:-1])
-                labels_list.append(padded_masks[1:])
-                advantages_list.append(score)
+                token_rows.append(tokens_list[i])
+                mask_rows.append(masks_list[i])
+                advantages_list.append(scores[i] if i < len(scores) else 0.0)
 
                 # Get temperature from overrides or default to 1.0
                 temp = 1.0
@@ -352,6 +377,25 @@ class BabylonAtroposTrainer:
                     temp = float(item["generation_params"].get("temperature", 1.0))
                 temperatures_list.append(temp)
 
+        # Pad into preallocated arrays: input_ids drop the last token, labels drop the first
+        padded_tokens = np.zeros((len(token_rows), max_token_len), dtype=np.int64)
+        padded_masks = np.full((len(mask_rows), max_token_len), -100, dtype=np.int64)
+        for row, (tokens, masks) in enumerate(zip(token_rows, mask_rows, strict=True)):
+            padded_tokens[row, : len(tokens)] = tokens
+            padded_masks[row, : len(masks)] = masks
+
+        input_ids = torch.from_numpy(np.ascontiguousarray(padded_tokens[:, :-1]))
+        labels = torch.from_numpy(np.ascontiguousarray(padded_masks[:, 1:]))
+        advantages = torch.tensor(advantages_list, dtype=torch.float32)
+        temperatures = torch.tensor(temperatures_list, dtype=torch.float32)
+
+        # Page-locked host memory lets train_step issue non-blocking H2D copies
+        if self.config.device.startswith("cuda"):
+            input_ids = input_ids.pin_memory()
+            labels = labels.pin_memory()
+            advantages = advantages.pin_memory()
+            temperatures = temperatures.pin_memory()
+
         # Split into batches
         batch_size = self.config.batch_size
         token_batches = []
@@ -359,23 +403,42 @@ class BabylonAtroposTrainer:
         advantage_batches = []
         temperature_batches = []
 
-        num_batches = len(input_ids_list) // batch_size
+        num_batches = len(token_rows) // batch_size
 
         for i in range(num_batches):
             start = i * batch_size
             end = start + batch_size
 
-            token_batches.append(torch.tensor(np.stack(input_ids_list[start:end])))
-            label_batches.append(torch.tensor(np.stack(labels_list[start:end])))
-            advantage_batches.append(
-                torch.tensor(advantages_list[start:end], dtype=torch.float32).view(-1, 1)
-            )
-            temperature_batches.append(
-                torch.tensor(temperatures_list[start:end], dtype=torch.float32).view(-1, 1, 1)
-            )
+            token_batches.append(input_ids[start:end])
+            label_batches.append(labels[start:end])
+            advantage_batches.append(advantages[start:end].view(-1, 1))
+            temperature_batches.append(temperatures[start:end].view(-1, 1, 1))
 
         return token_batches, label_batches, advantage_batches, temperature_batches
 
+    @staticmethod
+    def _group_normalized_scores(batch_data: list) -> list[np.ndarray]:
+        """Center (and scale, where the spread allows) each group's scores in one numpy pass"""
+        group_scores = [
+            np.asarray(item.get("scores", [0.0]), dtype=np.float64) for item in batch_data
+        ]
+        if not group_scores:
+            return []
+
+        sizes = np.array([len(scores) for scores in group_scores])
+        flat = np.concatenate(group_scores)
+        group_ids = np.repeat(np.arange(len(group_scores)), sizes)
+        counts = np.maximum(sizes, 1)
+
+        means = np.bincount(group_ids, weights=flat, minlength=len(sizes)) / counts
+        centered = flat - means[group_ids]
+        stds = np.sqrt(np.bincount(group_ids, weights=centered**2, minlength=len(sizes)) / counts)
+        scale = np.where(stds > 1e-8, stds, 1.0)
+
+        # Singleton groups keep their raw score
+        normalized = np.where(sizes[group_ids] > 1, centered / scale[group_ids], flat)
+        return np.split(normalized, np.cumsum(sizes)[:-1])
+
     def train_step(
         self,
         token_batches: list[torch.Tensor],
@@ -387,25 +450,26 @@ class BabylonAtroposTrainer:
         assert self.model is not None
         assert self.optimizer is not None
 
-        total_loss = 0.0
-        total_pos_logp = 0.0
-        total_neg_logp = 0.0
-        total_pos = 0
-        total_neg = 0
+        # Metrics stay on device as [loss, pos_logp, neg_logp, pos, neg] and are read back once
+        totals = torch.zeros(5, device=self.config.device)
+
+        # Average gradients over the micro-batches actually produced for this step
+        num_micro_batches = len(token_batches)
 
         for tokens, labels, advantages, temperatures in zip(
             token_batches, label_batches, advantage_batches, temperature_batches, strict=False
         ):
-            tokens = tokens.to(self.config.device)
-            labels = labels.to(self.config.device)
-            advantages = advantages.to(self.config.device)
+            tokens = tokens.to(self.config.device, non_blocking=True)
+            labels = labels.to(self.config.device, non_blocking=True)
+            advantages = advantages.to(self.config.device, non_blocking=True)
+            temperatures = temperatures.to(self.config.device, non_blocking=True)
 
             # Forward pass
-            outputs = self.model(tokens)
+            outputs = self.model(tokens, use_cache=False)
             logits = outputs.logits
 
             # Temperature scaling
-            t = temperatures.to(logits.device, logits.dtype)
+            t = temperatures.to(logits.dtype)
             t = torch.where(t <= 0, torch.ones_like(t), t)
             logits = logits / t
 
@@ -426,23 +490,19 @@ class BabylonAtroposTrainer:
                 mask_sum = mask.sum(dim=-1).clamp_min(1e-8)
 
                 avg_logp = (logp_per_token * mask).sum(dim=-1) / mask_sum
-                pos_logp = (avg_logp * pos.squeeze(-1)).sum().item()
-                neg_logp = (avg_logp * neg.squeeze(-1)).sum().item()
-
-                total_pos_logp += pos_logp
-                total_neg_logp += neg_logp
-                total_pos += pos.sum().item()
-                total_neg += neg.sum().item()
+                totals[1] += (avg_logp * pos.squeeze(-1)).sum()
+                totals[2] += (avg_logp * neg.squeeze(-1)).sum()
+                totals[3] += pos.sum()
+                totals[4] += neg.sum()
 
             # GRPO loss calculation
             grpo_loss_term = torch.exp(logp_per_token - logp_per_token.detach())
             grpo_loss = (
-                ((-grpo_loss_term * mask).sum(-1) / mask.sum(-1))
-                * advantages.to(logp_per_token.device).squeeze(-1)
-            ).mean() / self.config.gradient_accumulation_steps
+                ((-grpo_loss_term * mask).sum(-1) / mask.sum(-1)) * advantages.squeeze(-1)
+            ).mean() / num_micro_batches
 
             grpo_loss.backward()
-            total_loss += grpo_loss.item()
+            totals[0] += grpo_loss.detach()
 
         # Gradient clipping and optimizer step
         grad_norm = torch.nn.utils.clip_grad_norm_(
@@ -450,7 +510,14 @@ class BabylonAtroposTrainer:
         )
 
         self.optimizer.step()
-        self.optimizer.zero_grad()
+        self.optimizer.zero_grad(set_to_none=True)
+
+        # Single device-to-host sync for all step metrics
+        total_loss, total_pos_logp, total_neg_logp, total_pos, total_neg, grad_norm_value = (
+            torch.cat([totals, grad_norm.detach().to(totals.device, torch.float32).view(1)])
+            .cpu()
+            .tolist()
+        )
 
         # Normalize metrics
         if total_pos > 0:
@@ -460,28 +527,48 @@ class BabylonAtroposTrainer:
 
         return {
             "loss": total_loss,
-            "grad_norm": grad_norm.item(),
+            "grad_norm": grad_norm_value,
             "pos_logp": total_pos_logp,
             "neg_logp": total_neg_logp,
             "total_pos": total_pos,
             "total_neg": total_neg,
         }
 
-    def save_checkpoint(self, step: int, is_final: bool = False):
+    def save_checkpoint(self, step: int, is_final: bool = False) -> str:
         """Save model checkpoint"""
+        return self.save_checkpoint_async(step, is_final).result()
+
+    def save_checkpoint_async(self, step: int, is_final: bool = False) -> Future[str]:
+        """Snapshot weights to CPU, then write the checkpoint on a background thread"""
         assert self.model is not None
-        assert self.tokenizer is not None
 
         checkpoint_name = "final_model" if is_final else f"step_{step}"
         checkpoint_path = os.path.join(self.config.save_path, checkpoint_name)
 
+        # Copy each storage once so tied weights stay shared and save_pretrained dedups them
+        snapshots: dict[int, torch.Tensor] = {}
+        state_dict = {}
+        with torch.no_grad():
+            for name, tensor in self.model.state_dict().items():
+                ptr = tensor.data_ptr()
+                if ptr not in snapshots:
+                    snapshots[ptr] = tensor.detach().to("cpu", copy=True)
+                state_dict[name] = snapshots[ptr]
+
+        return self._checkpoint_executor.submit(self._write_checkpoint, checkpoint_path, state_dict)
+
+    def _write_checkpoint(self, checkpoint_path: str, state_dict: dict) -> str:
+        """Write a CPU state dict snapshot and tokenizer to checkpoint_path"""
+        assert self.model is not None
+        assert self.tokenizer is not None
+
         # Remove existing checkpoint
         if os.path.exists(checkpoint_path):
             shutil.rmtree(checkpoint_path)
 
         os.makedirs(checkpoint_path, exist_ok=True)
 
-        self.model.save_pretrained(checkpoint_path)
+        self.model.save_pretrained(checkpoint_path, state_dict=state_dict)
         self.tokenizer.save_pretrained(checkpoint_path)
 
         logger.info(f"Checkpoint saved: {checkpoint_path}")
@@ -513,6 +600,8 @@ class BabylonAtroposTrainer:
 
         batches_buffer: list = []
         all_metrics: list[dict] = []
+        checkpoint_futures: list[Future[str]] = []
+        pending_reload: Future[str] | None = None
 
         for step in range(self.config.training_steps):
             self.current_step = step + 1
@@ -560,18 +649,28 @@ class BabylonAtroposTrainer:
 
             all_metrics.append(metrics)
 
-            # Checkpoint and vLLM restart
+            # Restart vLLM on the checkpoint written while this step trained. Restarting
+            # between steps keeps training activations freed while vLLM claims its memory.
+            if pending_reload is not None:
+                self.start_vllm(pending_reload.result())
+                pending_reload = None
+
+            # Checkpoint (written in the background during the next step)
             should_checkpoint = (
                 self.current_step % self.config.vllm_restart_interval == 0
                 or self.current_step == self.config.training_steps
             )
 
             if should_checkpoint:
-                checkpoint_path = self.save_checkpoint(self.current_step)
+                checkpoint_future = self.save_checkpoint_async(self.current_step)
+                checkpoint_futures.append(checkpoint_future)
 
-                # Restart vLLM with new weights
                 if self.current_step < self.config.training_steps:
-                    self.start_vllm(checkpoint_path)
+                    pending_reload = checkpoint_future
+
+        # Surface any background write failure before the final save
+        for checkpoint_future in checkpoint_futures:
+            checkpoint_future.result()
 
         # Final save
         final_checkpoint = self.save_checkpoint(self.current_step, is_final=True)
@@ -597,6 +696,9 @@ def main():
     parser.add_argument("--model", default="Qwen/Qwen2.5-3B-Instruct", help="Model to train")
     parser.add_argument("--steps", type=int, default=100, help="Training steps")
     parser.add_argument("--batch-size", type=int, default=4, help="Batch size")
+    parser.add_argument(
+        "--grad-accum", type=int, default=8, help="Micro-batches accumulated per optimizer step"
+    )
     parser.add_argument("--lr", type=float, default=1e-5, help="Learning rate")
     parser.add_argument("--save-path", default="./trained_models", help="Checkpoint directory")
     parser.add_argument("--api-url", default="http://localhost:8000", help="Atropos API URL")
@@ -604,6 +706,20 @@ def main():
     parser.add_argument(
         "--log-file", default="./logs/training_metrics.jsonl", help="Metrics log file"
     )
+    parser.add_argument(
+        "--optimizer",
+        choices=["adamw", "paged_adamw_8bit"],
+        default="adamw",
+        help="Optimizer (paged_adamw_8bit requires bitsandbytes)",
+    )
+    parser.add_argument(
+        "--no-gradient-checkpointing",
+        action="store_true",
+        help="Keep activations instead of recomputing them (faster when memory allows)",
+    )
+    parser.add_argument(
+        "--compile", action="store_true", help="Compile the policy model with torch.compile"
+    )
 
     args = parser.parse_args()
 
@@ -611,11 +727,15 @@ def main():
         model_name=args.model,
         training_steps=args.steps,
         batch_size=args.batch_size,
+        gradient_accumulation_steps=args.grad_accum,
         learning_rate=args.lr,
         save_path=args.save_path,
         api_url=args.api_url,
         vllm_port=args.vllm_port,
         log_file=args.log_file,
+        optimizer=args.optimizer,
+        gradient_checkpointing=not args.no_gradient_checkpointing,
+        compile_model=args.compile,
     )
 
     trainer = BabylonAtroposTrainer(config)
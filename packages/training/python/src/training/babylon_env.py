@@ -14,18 +14,21 @@ Key features:
 Based on: https://github.com/NousResearch/atropos/blob/main/environments/rlaif_server.py
 """
 
-import copy
+import asyncio
 import json
 import logging
 import os
-import random
+from collections import deque
+from functools import lru_cache
 from typing import TYPE_CHECKING, Optional
 
 if TYPE_CHECKING:
     from .tinker_client import BabylonTinkerClient
 
 import asyncpg
+import numpy as np
 import openai
+import orjson
 
 # Atropos imports
 from atroposlib.envs.base import (
@@ -38,15 +41,113 @@ from atroposlib.envs.base import (
 from dotenv import load_dotenv
 from pydantic import Field
 
-from ..models import Action
+from ..models import Action, LLMCall
 from .quality_utils import calculate_detailed_tick_quality
 from .rewards import TrajectoryRewardInputs, composite_reward
 
 logger = logging.getLogger(__name__)
 
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    """Decode jsonb columns with orjson inside the driver instead of per row."""
+    await conn.set_type_codec(
+        "jsonb",
+        encoder=lambda value: orjson.dumps(value).decode(),
+        decoder=orjson.loads,
+        schema="pg_catalog",
+        format="text",
+    )
+
+
 # Load environment variables
 load_dotenv()
 
+# camelCase keys written by the TypeScript trajectory logger -> canonical snake_case
+_STEP_KEYS = {"llmCalls": "llm_calls", "environmentState": "environment_state"}
+_LLM_CALL_KEYS = {"userPrompt": "user_prompt"}
+_ENV_STATE_KEYS = {
+    "agentBalance": "agent_balance",
+    "agentPnL": "agent_pnl",
+    "openPositions": "open_positions",
+}
+_ACTION_KEYS = {"actionType": "action_type"}
+
+
+def _rename_keys(data: dict, keys: dict[str, str]) -> None:
+    """Rename camelCase keys in place; the camelCase value wins when both exist."""
+    for camel, snake in keys.items():
+        if camel in data:
+            data[snake] = data.pop(camel)
+
+
+def _normalize_step(step):
+    """Rewrite a decoded step to snake_case keys once, so readers do single lookups."""
+    if not isinstance(step, dict):
+        return step
+
+    _rename_keys(step, _STEP_KEYS)
+    for llm_call in step.get("llm_calls") or ():
+        if isinstance(llm_call, dict):
+            _rename_keys(llm_call, _LLM_CALL_KEYS)
+    if isinstance(step.get("environment_state"), dict):
+        _rename_keys(step["environment_state"], _ENV_STATE_KEYS)
+    if isinstance(step.get("action"), dict):
+        _rename_keys(step["action"], _ACTION_KEYS)
+    return step
+
+
+def _system_content(traj: dict) -> str:
+    """Render the system prompt for a trajectory; depends only on its summary fields."""
+    return f"""You are a trading agent in Babylon prediction markets.
+
+Agent: {traj.get("agent_name", "Agent")}
+Window: {traj.get("window_id", "Unknown")}
+Scenario: {traj.get("scenario_id", "General Trading")}
+Final P&L: ${traj.get("final_pnl", 0):.2f}
+Episode Length: {traj.get("episode_length", 0)} steps
+
+Your goal is to make profitable trading decisions based on market analysis.
+You receive market updates and must analyze, reason, and then act."""
+
+
+def _length_buckets(trajectories: list[dict], group_size: int) -> list[list[dict]]:
+    """
+    Split trajectories into buckets of similar estimated length.
+
+    Each bucket holds at least two groups' worth of trajectories (or all of them when
+    there are fewer), so sampling a group from one bucket still varies between draws.
+    """
+    ordered = sorted(trajectories, key=lambda t: t["est_tokens"])
+    n = len(ordered)
+    n_buckets = max(1, n // (2 * group_size))
+    return [ordered[i * n // n_buckets : (i + 1) * n // n_buckets] for i in range(n_buckets)]
+
+
+@lru_cache(maxsize=16)
+def _role_template_overhead(tokenizer, role: str) -> int:
+    """Tokens the chat template adds around one message with the given role."""
+    system = {"role": "system", "content": ""}
+    # Measured after an empty system message so templates that inject a default
+    # system prompt do not count it against every user or assistant turn
+    with_role = tokenizer.apply_chat_template(
+        [system, {"role": role, "content": ""}], tokenize=True, return_dict=False
+    )
+    return len(with_role) - len(
+        tokenizer.apply_chat_template([system], tokenize=True, return_dict=False)
+    )
+
+
+@lru_cache(maxsize=65536)
+def _message_token_length(tokenizer, role: str, content: str) -> int:
+    """
+    Token length of one message inside the chat template.
+
+    Cached by content, so the system message and step prompts of a trajectory are
+    tokenized once no matter how often the trajectory is rolled out.
+    """
+    content_ids = tokenizer(content, add_special_tokens=False)["input_ids"]
+    return _role_template_overhead(tokenizer, role) + len(content_ids)
+
 
 class BabylonEnvConfig(BaseEnvConfig):
     """Configuration for Babylon RLAIF environment"""
@@ -66,6 +167,9 @@ class BabylonEnvConfig(BaseEnvConfig):
     max_steps_per_trajectory: int = Field(
         default=20, description="Maximum steps to include from each trajectory"
     )
+    seed: int | None = Field(
+        default=None, description="Seed for trajectory group sampling; None draws from OS entropy"
+    )
 
     # RLAIF Judge settings (Legacy - kept for config compatibility)
     judge_model: str = Field(
@@ -130,7 +234,9 @@ class BabylonRLAIFEnv(BaseEnv):
         self.current_window_idx: int = 0
         self.windows_processed: int = 0
         self.eval_metrics: list[dict] = []
-        self.judgement_samples: list[tuple[str, str, str]] = []
+        self.judgement_samples: deque[tuple[str, str, str]] = deque(maxlen=10)
+        self._rng = np.random.default_rng(config.seed)
+        self._refresh_task: asyncio.Task | None = None
 
         # Initialize OpenAI client (Legacy/Fallback)
         self.judge_client = openai.AsyncOpenAI()
@@ -192,7 +298,14 @@ class BabylonRLAIFEnv(BaseEnv):
             raise ValueError("DATABASE_URL not set in environment or config")
 
         self.db_pool = await asyncpg.create_pool(
-            self.config.database_url, min_size=2, max_size=10, command_timeout=60
+            self.config.database_url,
+            min_size=2,
+            max_size=10,
+            command_timeout=60,
+            init=_init_connection,
+            # The trajectory scan is a single streamed query; JIT compilation only
+            # adds planning latency to it
+            server_settings={"jit": "off"},
         )
         logger.info("Connected to PostgreSQL database")
 
@@ -205,50 +318,68 @@ class BabylonRLAIFEnv(BaseEnv):
         if not self.db_pool:
             raise RuntimeError("Database not connected")
 
-        async with self.db_pool.acquire() as conn:
-            # Get trajectories with valid steps from recent windows
-            rows = await conn.fetch(
+        groups: dict[str, list[dict]] = {}
+
+        async with self.db_pool.acquire() as conn, conn.transaction():
+            # Stream trajectories with valid steps from recent windows, grouping
+            # by window/scenario as rows arrive (cursors need a transaction)
+            rows = conn.cursor(
                 """
-                SELECT
-                    t."trajectoryId",
-                    t."agentId",
-                    t."windowId",
-                    t."scenarioId",
-                    t."stepsJson",
-                    t."finalPnL",
-                    t."episodeLength",
-                    t."totalReward",
-                    u.username as agent_name
-                FROM trajectories t
-                LEFT JOIN "User" u ON t."agentId" = u.id
-                WHERE
-                    t."createdAt" > NOW() - $1::interval
-                    AND t."stepsJson" IS NOT NULL
-                    AND t."stepsJson"::text != 'null'
-                    AND t."stepsJson"::text != '[]'
-                    AND t."episodeLength" >= $2
-                ORDER BY t."windowId", t."scenarioId", t."createdAt"
+                WITH candidates AS (
+                    SELECT
+                        t."trajectoryId",
+                        t."agentId",
+                        t."windowId",
+                        t."scenarioId",
+                        t."stepsJson"::jsonb AS steps,
+                        length(t."stepsJson"::text) AS steps_chars,
+                        t."finalPnL",
+                        t."episodeLength",
+                        t."totalReward",
+                        t."createdAt",
+                        u.username as agent_name
+                    FROM trajectories t
+                    LEFT JOIN "User" u ON t."agentId" = u.id
+                    WHERE
+                        t."createdAt" > NOW() - $1::interval
+                        AND t."stepsJson" IS NOT NULL
+                        AND t."stepsJson"::text != 'null'
+                        AND t."stepsJson"::text != '[]'
+                        AND t."episodeLength" >= $2
+                ),
+                long_enough AS (
+                    SELECT * FROM candidates
+                    WHERE CASE
+                        WHEN jsonb_typeof(steps) = 'array' THEN jsonb_array_length(steps)
+                        ELSE 0
+                    END >= $2
+                ),
+                grouped AS (
+                    SELECT
+                        *,
+                        count(*) OVER (PARTITION BY "windowId", "scenarioId") AS group_count
+                    FROM long_enough
+                )
+                SELECT * FROM grouped
+                WHERE group_count >= $3
+                ORDER BY "windowId", "scenarioId", "createdAt"
             """,
                 f"{self.config.lookback_hours} hours",
                 self.config.min_actions_per_trajectory,
+                self.config.min_agents_per_window,
+                prefetch=256,
             )
+            async for row in rows:
+                # Create group key from window and scenario
+                group_key = f"{row['windowId']}_{row['scenarioId'] or 'default'}"
 
-        # Group trajectories by window/scenario
-        groups: dict[str, list[dict]] = {}
-        for row in rows:
-            # Create group key from window and scenario
-            group_key = f"{row['windowId']}_{row['scenarioId'] or 'default'}"
-
-            if group_key not in groups:
-                groups[group_key] = []
+                if group_key not in groups:
+                    groups[group_key] = []
 
-            # Parse steps JSON
-            steps = json.loads(row["stepsJson"] or "[]")
-            if len(steps) < self.config.min_actions_per_trajectory:
-                continue
+                # Decoded by the connection's jsonb codec; step count already filtered in SQL
+                steps = [_normalize_step(step) for step in row["steps"]]
 
-            groups[group_key].append(
-                {
+                traj = {
                     "trajectory_id": row["trajectoryId"],
                     "agent_id": row["agentId"],
                     "agent_name": row["agent_name"] or row["agentId"][:8],
@@ -258,18 +389,28 @@ class BabylonRLAIFEnv(BaseEnv):
                     "final_pnl": float(row["finalPnL"] or 0),
                     "episode_length": row["episodeLength"] or len(steps),
                     "total_reward": float(row["totalReward"] or 0),
+                    # Rough token estimate (~4 chars/token) used to bucket similar lengths
+                    "est_tokens": (row["steps_chars"] or 0) // 4,
                 }
-            )
+                # Summary fields are fixed once loaded, so render the system prompt here
+                # instead of on every resample of this trajectory
+                traj["system_content"] = _system_content(traj)
+                groups[group_key].append(traj)
 
-        # Filter groups with enough trajectories
+        # Groups below min_agents_per_window were dropped in SQL; split each into
+        # length buckets so get_next_item can sample similar-length sequences
         self.trajectory_cache = [
-            {"group_key": k, "trajectories": v}
+            {
+                "group_key": k,
+                "trajectories": v,
+                "length_buckets": _length_buckets(v, self.config.group_size),
+            }
             for k, v in groups.items()
-            if len(v) >= self.config.min_agents_per_window
         ]
 
         # Shuffle for variety
-        random.shuffle(self.trajectory_cache)
+        order = self._rng.permutation(len(self.trajectory_cache))
+        self.trajectory_cache = [self.trajectory_cache[i] for i in order]
 
     async def log_metrics(self, metrics: dict | None = None):
         """Log metrics (wandb removed - use local logging)"""
@@ -288,17 +429,19 @@ class BabylonRLAIFEnv(BaseEnv):
         # Log judgement samples locally
         if len(self.judgement_samples) > 0:
             logger.info(f"Judgement samples: {len(self.judgement_samples)}")
-            for item in self.judgement_samples[-3:]:
+            for item in list(self.judgement_samples)[-3:]:
                 logger.debug(f"  PnL: {item[0]}, Response: {item[1][:50]}..., Score: {item[2]}")
 
-        self.judgement_samples = []  # Clear after logging
+        self.judgement_samples.clear()  # Clear after logging
         return metrics
 
     async def get_next_item(self) -> tuple | None:
         """Get next trajectory group for scoring"""
         if not self.trajectory_cache:
-            # Reload trajectories if cache is empty
-            await self._load_trajectories()
+            # Reload trajectories if cache is empty; concurrent workers share one reload
+            if self._refresh_task is None or self._refresh_task.done():
+                self._refresh_task = asyncio.create_task(self._load_trajectories())
+            await asyncio.shield(self._refresh_task)
 
         if not self.trajectory_cache:
             logger.warning("No trajectories available")
@@ -308,10 +451,15 @@ class BabylonRLAIFEnv(BaseEnv):
         group = self.trajectory_cache[self.current_window_idx % len(self.trajectory_cache)]
         self.current_window_idx += 1
 
-        # Sample trajectories for this batch
+        # Sample at random within one length bucket so rollouts in a batch finish
+        # together without fixing the group's composition
         trajs = group["trajectories"]
-        if len(trajs) > self.config.group_size:
-            sampled = random.sample(trajs, self.config.group_size)
+        group_size = self.config.group_size
+        if len(trajs) > group_size:
+            buckets = group["length_buckets"]
+            bucket = buckets[self._rng.integers(len(buckets))]
+            picks = self._rng.choice(len(bucket), size=group_size, replace=False)
+            sampled = [bucket[i] for i in picks]
         else:
             sampled = trajs
 
@@ -331,63 +479,11 @@ class BabylonRLAIFEnv(BaseEnv):
             logger.warning(f"Group {group_key} has insufficient trajectories")
             return None, []
 
-        # Collect responses from the training model for each trajectory
-        rollout_data = []
-
-        async with self.server.managed_server(tokenizer=self.tokenizer) as managed:
-            for traj in trajectory_group:
-                # Build chat messages from trajectory
-                messages = self._trajectory_to_messages(traj)
-
-                if len(messages) < 2:
-                    continue
-
-                # Truncate to max length
-                if (
-                    len(self.tokenizer.apply_chat_template(messages))
-                    > self.config.max_token_length - 512
-                ):
-                    # Keep system + last N messages
-                    messages = [
-                        messages[0],
-                        *messages[-(self.config.max_steps_per_trajectory * 2) :],
-                    ]
-
-                # Generate completion from training model
-                completion = await managed.chat_completion(
-                    messages=messages,
-                    n=1,
-                    max_tokens=self.config.max_token_length // 3,
-                )
-
-                state = managed.get_state()
-                nodes = state["nodes"]
-
-                if not nodes:
-                    continue
-
-                node = nodes[0]
-                response_content = (
-                    completion.choices[0].message.content if completion.choices else ""
-                )
-
-                # Build full conversation with response
-                full_messages = copy.deepcopy(messages)
-                full_messages.append({"role": "assistant", "content": response_content})
-
-                rollout_data.append(
-                    {
-                        "trajectory": traj,
-                        "generated_response": response_content,  # NEW: Store explicitly for Judge
-                        "messages": full_messages,
-                        "tokens": node.tokens,
-                        "masks": node.masked_tokens,
-                        "logprobs": node.logprobs,
-                        "finish_reason": completion.choices[0].finish_reason
-                        if completion.choices
-                        else "stop",
-                    }
-                )
+        # Roll out every trajectory in the group concurrently; the calls are I/O bound
+        results = await asyncio.gather(
+            *(self._rollout_trajectory(traj) for traj in trajectory_group)
+        )
+        rollout_data = [result for result in results if result is not None]
 
         if len(rollout_data) < 2:
             logger.warning(f"Insufficient rollouts for group {group_key}")
@@ -399,6 +495,77 @@ class BabylonRLAIFEnv(BaseEnv):
         self.windows_processed += 1
         return scored_data, []
 
+    async def _rollout_trajectory(self, traj: dict) -> dict | None:
+        """
+        Generate one completion for a trajectory from the training model.
+
+        Each rollout uses its own managed server so its tracked node is the only
+        one in state, which keeps concurrent rollouts in a group independent.
+        """
+        # Build chat messages from trajectory
+        messages = self._trajectory_to_messages(traj)
+
+        if len(messages) < 2:
+            return None
+
+        # Truncate to max length
+        messages = self._fit_to_context(messages)
+
+        async with self.server.managed_server(tokenizer=self.tokenizer) as managed:
+            # Generate completion from training model
+            completion = await managed.chat_completion(
+                messages=messages,
+                n=1,
+                max_tokens=self.config.max_token_length // 3,
+            )
+
+            state = managed.get_state()
+            nodes = state["nodes"]
+
+        if not nodes:
+            return None
+
+        node = nodes[0]
+        response_content = completion.choices[0].message.content if completion.choices else ""
+
+        return {
+            "trajectory": traj,
+            "generated_response": response_content,  # NEW: Store explicitly for Judge
+            "tokens": node.tokens,
+            "masks": node.masked_tokens,
+            "logprobs": node.logprobs,
+            "finish_reason": completion.choices[0].finish_reason if completion.choices else "stop",
+        }
+
+    def _fit_to_context(self, messages: list[dict[str, str]]) -> list[dict[str, str]]:
+        """
+        Truncate messages to the prompt budget, keeping the system message.
+
+        The prompt length is the sum of cached per-message token lengths, exact for
+        templates that wrap each message on its own (the 512-token reserve covers a
+        BOS or generation prompt), so no message is tokenized twice. Over budget, the history is capped to the last
+        max_steps_per_trajectory exchanges and then cut to the longest suffix that
+        fits, starting at a user turn. If even the last user turn does not fit, it
+        is kept anyway.
+        """
+        budget = self.config.max_token_length - 512
+        lengths = np.fromiter(
+            (_message_token_length(self.tokenizer, m["role"], m["content"]) for m in messages),
+            dtype=np.int64,
+            count=len(messages),
+        )
+        if lengths.sum() <= budget:
+            return messages
+
+        system = messages[0]
+        history = messages[1:][-2 * self.config.max_steps_per_trajectory :]
+        # suffix_tokens[i] is the token count of history[i:]
+        suffix_tokens = np.cumsum(lengths[len(messages) - len(history) :][::-1])[::-1]
+        user_starts = np.flatnonzero([m["role"] == "user" for m in history])
+        fitting = user_starts[suffix_tokens[user_starts] <= budget - lengths[0]]
+        start = fitting[0] if fitting.size else user_starts[-1]
+        return [system, *history[start:]]
+
     def _trajectory_to_messages(self, traj: dict) -> list[dict[str, str]]:
         """
         Convert a Babylon trajectory to chat messages.
@@ -412,18 +579,8 @@ class BabylonRLAIFEnv(BaseEnv):
         """
         messages = []
 
-        # System message with full context
-        system_content = f"""You are a trading agent in Babylon prediction markets.
-
-Agent: {traj.get("agent_name", "Agent")}
-Window: {traj.get("window_id", "Unknown")}
-Scenario: {traj.get("scenario_id", "General Trading")}
-Final P&L: ${traj.get("final_pnl", 0):.2f}
-Episode Length: {traj.get("episode_length", 0)} steps
-
-Your goal is to make profitable trading decisions based on market analysis.
-You receive market updates and must analyze, reason, and then act."""
-
+        # System message with full context (rendered once at load for cached trajectories)
+        system_content = traj.get("system_content") or _system_content(traj)
         messages.append({"role": "system", "content": system_content})
 
         # Convert steps to user/assistant exchanges
@@ -440,88 +597,94 @@ You receive market updates and must analyze, reason, and then act."""
 
             # PRIORITY 1: Use actual LLM calls if available
             # This captures the REAL prompts and responses the agent used
-            llm_calls = step.get("llmCalls", step.get("llm_calls", []))
+            llm_calls = step.get("llm_calls")
 
             if llm_calls:
+                # Environment state context shared by every call in this step
+                env_state = step.get("environment_state")
+                if env_state:
+                    state_line = (
+                        f"State: Balance=${env_state.get('agent_balance', 0):.2f}, "
+                        f"P&L=${env_state.get('agent_pnl', 0):.2f}, "
+                        f"Positions={env_state.get('open_positions', 0)}\n\n"
+                    )
+
                 # Include ALL LLM calls from this step
                 for _call_idx, llm_call in enumerate(llm_calls):
                     purpose = llm_call.get("purpose", "action")
 
                     # Build rich user content from the actual prompt
-                    user_prompt = llm_call.get("userPrompt", llm_call.get("user_prompt", ""))
+                    user_prompt = llm_call.get("user_prompt", "")
 
                     # Combine system context with user prompt for training
-                    user_content = f"[Step {step_idx + 1}, {purpose.upper()}]\n"
+                    user_parts = [f"[Step {step_idx + 1}, {purpose.upper()}]\n"]
 
                     # Add environment state context
-                    env_state = step.get("environmentState", step.get("environment_state", {}))
                     if env_state:
-                        balance = env_state.get("agentBalance", env_state.get("agent_balance", 0))
-                        pnl = env_state.get("agentPnL", env_state.get("agent_pnl", 0))
-                        positions = env_state.get(
-                            "openPositions", env_state.get("open_positions", 0)
-                        )
-                        user_content += f"State: Balance=${balance:.2f}, P&L=${pnl:.2f}, Positions={positions}\n\n"
+                        user_parts.append(state_line)
 
                     # Add the actual user prompt
                     if user_prompt:
-                        user_content += user_prompt
+                        user_parts.append(user_prompt)
 
-                    messages.append({"role": "user", "content": user_content})
+                    messages.append({"role": "user", "content": "".join(user_parts)})
 
                     # Assistant response - use FULL response, not truncated
                     response = llm_call.get("response", "")
                     reasoning = llm_call.get("reasoning", "")
 
                     # Build comprehensive assistant response
-                    assistant_content = ""
+                    assistant_parts = []
 
                     # Include reasoning if available
                     if reasoning:
-                        assistant_content += f"<thinking>\n{reasoning}\n</thinking>\n\n"
+                        assistant_parts.append(f"<thinking>\n{reasoning}\n</thinking>\n\n")
 
                     # Include the actual response
                     if response:
-                        assistant_content += response
+                        assistant_parts.append(response)
 
+                    assistant_content = "".join(assistant_parts)
                     if assistant_content.strip():
                         messages.append({"role": "assistant", "content": assistant_content})
             else:
                 # FALLBACK: Build messages from environment state and action
-                env_state = step.get("environmentState", step.get("environment_state", {}))
-                balance = env_state.get("agentBalance", env_state.get("agent_balance", 0))
-                pnl = env_state.get("agentPnL", env_state.get("agent_pnl", 0))
-                positions = env_state.get("openPositions", env_state.get("open_positions", 0))
+                env_state = step.get("environment_state") or {}
+                balance = env_state.get("agent_balance", 0)
+                pnl = env_state.get("agent_pnl", 0)
+                positions = env_state.get("open_positions", 0)
 
-                user_content = f"[Step {step_idx + 1}]\nMarket Update:\n- Balance: ${balance:.2f}\n- P&L: ${pnl:.2f}\n- Open Positions: {positions}"
+                user_parts = [
+                    f"[Step {step_idx + 1}]\nMarket Update:\n- Balance: ${balance:.2f}\n- P&L: ${pnl:.2f}\n- Open Positions: {positions}"
+                ]
 
                 # Add any observations
                 if "observation" in step:
                     obs = step["observation"]
                     if isinstance(obs, dict):
-                        user_content += f"\n- Markets: {len(obs.get('markets', []))}"
-                        user_content += f"\n- News: {len(obs.get('news', []))}"
+                        user_parts.append(f"\n- Markets: {len(obs.get('markets', []))}")
+                        user_parts.append(f"\n- News: {len(obs.get('news', []))}")
 
-                messages.append({"role": "user", "content": user_content})
+                messages.append({"role": "user", "content": "".join(user_parts)})
 
                 # Agent action as assistant message
-                action = step.get("action", {})
-                action_type = action.get("actionType", action.get("action_type", "wait"))
+                action = step.get("action") or {}
+                action_type = action.get("action_type", "wait")
                 params = action.get("parameters", {})
                 reasoning = action.get("reasoning", "")
 
                 # Build comprehensive assistant response
-                assistant_content = ""
+                assistant_parts = []
 
                 # Include FULL reasoning (not truncated!)
                 if reasoning:
-                    assistant_content += f"<thinking>\n{reasoning}\n</thinking>\n\n"
+                    assistant_parts.append(f"<thinking>\n{reasoning}\n</thinking>\n\n")
 
-                assistant_content += f"Action: {action_type}"
+                assistant_parts.append(f"Action: {action_type}")
                 if params:
-                    assistant_content += f"\nParameters: {json.dumps(params, indent=2)}"
+                    assistant_parts.append(f"\nParameters: {json.dumps(params, indent=2)}")
 
-                messages.append({"role": "assistant", "content": assistant_content})
+                messages.append({"role": "assistant", "content": "".join(assistant_parts)})
 
         return messages
 
@@ -530,74 +693,86 @@ You receive market updates and must analyze, reason, and then act."""
         Score rollouts using Deterministic Judge logic (rewards.py).
         Replaces OpenAI calls with robust Python logic for PnL, Format, and Reasoning verification.
         """
-        scores = []
-
-        for item in rollout_data:
-            traj = item["trajectory"]
-            generated_response = item["generated_response"]
-
-            # 1. Quality Scores (Format & Reasoning)
-            # We treat the generated response as a single 'tick' of output to be judged.
-            # Create a mock structure for the detailed quality calculation.
-            mock_calls = [{"response": generated_response, "reasoning": generated_response}]
-            mock_action = Action(
-                action_type="unknown", parameters={}, success=True
-            )  # Fallback action
-
-            # Calculate granular scores
-            fmt_score, rsn_score = calculate_detailed_tick_quality(
-                llm_calls=mock_calls,
-                action=mock_action,
-                feedback=None,
-                archetype="default",  # Could pull from traj if available
-            )
-
-            # 2. Financial Context (from trajectory history)
-            # In RLAIF, we attribute the Trajectory's final PnL to this generation step as a proxy.
-            final_pnl = traj.get("final_pnl", 0.0)
-
-            reward_inputs = TrajectoryRewardInputs(
-                final_pnl=final_pnl,
-                starting_balance=10000.0,  # Baseline Assumption
-                format_score=fmt_score,
-                reasoning_score=rsn_score,
-                # Cannot determine instantaneous risk from text alone without sim state, so 0
-                risky_actions_count=0,
-            )
-
-            # 3. Compute Composite Score
-            final_score = composite_reward(reward_inputs)
-            scores.append(final_score)
-
-            # Logging sample for debugging
-            if len(self.judgement_samples) < 10:
-                self.judgement_samples.append(
-                    (
-                        str(final_pnl),
-                        generated_response[:100],
-                        f"Score: {final_score:.2f} (Fmt: {fmt_score}, Rsn: {rsn_score})",
-                    )
+        # The heuristics are CPU-bound Python; score the whole group on a worker thread
+        # so in-flight rollouts keep making progress on the event loop meanwhile.
+        results = await asyncio.to_thread(
+            lambda: [self._score_rollout(item) for item in rollout_data]
+        )
+        scores = [final_score for final_score, _, _ in results]
+
+        for item, (final_score, fmt_score, rsn_score) in zip(rollout_data, results, strict=True):
+            # Logging sample for debugging (bounded deque keeps the most recent 10)
+            self.judgement_samples.append(
+                (
+                    str(item["trajectory"].get("final_pnl", 0.0)),
+                    item["generated_response"][:100],
+                    f"Score: {final_score:.2f} (Fmt: {fmt_score}, Rsn: {rsn_score})",
                 )
+            )
 
         # Normalize scores to mean 0 for GRPO stability
-        mean_score = sum(scores) / len(scores) if scores else 0
-        centered_scores = [s - mean_score for s in scores]
+        scores_arr = np.asarray(scores, dtype=np.float64)
+        centered_scores = (scores_arr - scores_arr.mean() if scores else scores_arr).tolist()
 
         # Build ScoredDataGroup
         scored_group = ScoredDataGroup()
-        scored_group["tokens"] = []
-        scored_group["masks"] = []
-        scored_group["scores"] = []
-        scored_group["inference_logprobs"] = []
-
-        for i, rollout in enumerate(rollout_data):
-            scored_group["tokens"].append(rollout["tokens"])
-            scored_group["masks"].append(rollout["masks"])
-            scored_group["scores"].append(centered_scores[i])
-            scored_group["inference_logprobs"].append(rollout["logprobs"])
+        scored_group["tokens"] = [rollout["tokens"] for rollout in rollout_data]
+        scored_group["masks"] = [rollout["masks"] for rollout in rollout_data]
+        scored_group["scores"] = centered_scores
+        scored_group["inference_logprobs"] = [rollout["logprobs"] for rollout in rollout_data]
 
         return scored_group
 
+    def _score_rollout(self, item: dict) -> tuple[float, float, float]:
+        """Score one rollout; returns (composite score, format score, reasoning score)."""
+        traj = item["trajectory"]
+        generated_response = item["generated_response"]
+
+        # 1. Quality Scores (Format & Reasoning)
+        # We treat the generated response as a single 'tick' of output to be judged.
+        # Create a mock structure for the detailed quality calculation.
+        # The scorer reads attributes, so this must be an LLMCall rather than a dict.
+        # It works on the text directly; the rollout's tokens are never re-tokenized.
+        mock_calls = [
+            LLMCall(
+                model=self.config.tokenizer_name,
+                system_prompt="",
+                user_prompt="",
+                response=generated_response,
+                reasoning=generated_response,
+                temperature=1.0,
+                max_tokens=self.config.max_token_length // 3,
+                purpose="response",
+            )
+        ]
+        mock_action = Action(action_type="unknown", parameters={}, success=True)  # Fallback action
+
+        # Calculate granular scores
+        fmt_score, rsn_score = calculate_detailed_tick_quality(
+            llm_calls=mock_calls,
+            action=mock_action,
+            feedback=None,
+            archetype="default",  # Could pull from traj if available
+        )
+
+        # 2. Financial Context (from trajectory history)
+        # In RLAIF, we attribute the Trajectory's final PnL to this generation step as a proxy.
+        final_pnl = traj.get("final_pnl", 0.0)
+
+        reward_inputs = TrajectoryRewardInputs(
+            final_pnl=final_pnl,
+            starting_balance=10000.0,  # Baseline Assumption
+            # Clamp scores to [0, 1] range as required by Pydantic model
+            format_score=max(0.0, min(1.0, fmt_score)),
+            reasoning_score=max(0.0, min(1.0, rsn_score)),
+            # Cannot determine instantaneous risk from text alone without sim state, so 0
+            risky_actions_count=0,
+        )
+
+        # 3. Compute Composite Score
+        final_score = composite_reward(reward_inputs)
+        return final_score, fmt_score, rsn_score
+
     async def evaluate(self, *args, **kwargs):  # noqa: ARG002
         """Evaluate current model performance"""
         logger.info("Running evaluation...")
@@ -609,7 +784,7 @@ You receive market updates and must analyze, reason, and then act."""
             if not self.trajectory_cache:
                 break
 
-            group = random.choice(self.trajectory_cache)
+            group = self.trajectory_cache[self._rng.integers(len(self.trajectory_cache))]
             trajs = group["trajectories"]
 
             avg_pnl = sum(t.get("final_pnl", 0) for t in trajs) / len(trajs)
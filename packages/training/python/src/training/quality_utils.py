@@ -50,6 +50,35 @@ ARCHETYPE_WEIGHTS: dict[str, dict[str, float]] = {
     "default": {"llm_calls": 0.4, "reasoning": 0.3, "action": 0.2, "feedback": 0.1},
 }
 
+# Decision XML attribute patterns (either quote style)
+_TICKER_ATTR_RE = re.compile(r"""ticker=(?:"[^"]+"|'[^']+')""")
+_MARKET_ATTR_RE = re.compile(r"""marketId=(?:"[^"]+"|'[^']+')""")
+_AMOUNT_ATTR_RE = re.compile(r"""amount=(?:"[^"]+"|'[^']+')""")
+
+# Reasoning heuristics
+_STRUCTURE_RE = re.compile(r"(\d+[\.\):]|\-|\*|\•)")
+_NUMERIC_RE = re.compile(r"\$?\d+(?:\.\d+)?(?:%|k|K|M)?")
+
+# Sentiment indicators
+_BULLISH_WORDS = ("bullish", "buy", "long", "upward", "positive", "opportunity", "moon")
+_BEARISH_WORDS = ("bearish", "sell", "short", "downward", "negative", "avoid", "dump")
+_WAIT_WORDS = ("wait", "hold", "unclear", "uncertain", "need more data", "observing")
+_CONCLUSION_MARKERS = (
+    "therefore",
+    "conclusion",
+    "decision",
+    "recommend",
+    "suggest",
+    "final",
+    "result",
+    "action:",
+    "execute",
+)
+
+_BUY_ACTIONS = frozenset({"buy", "buy_prediction", "open_perp", "long"})
+_SELL_ACTIONS = frozenset({"sell", "sell_prediction", "close_perp", "short"})
+_WAIT_ACTIONS = frozenset({"wait", "hold"})
+
 
 def validate_xml_structure(response: str) -> float:
     """
@@ -77,11 +106,9 @@ def validate_xml_structure(response: str) -> float:
         return -0.5  # Has wrappers but no decision?
 
     # Check for critical attributes (simple heuristic regex to handle both quote styles)
-    has_ticker = re.search(r'ticker="[^"]+"', response) or re.search(r"ticker='[^']+'", response)
-    has_market = re.search(r'marketId="[^"]+"', response) or re.search(
-        r"marketId='[^']+'", response
-    )
-    has_amount = re.search(r'amount="[^"]+"', response) or re.search(r"amount='[^']+'", response)
+    has_ticker = _TICKER_ATTR_RE.search(response)
+    has_market = _MARKET_ATTR_RE.search(response)
+    has_amount = _AMOUNT_ATTR_RE.search(response)
 
     # Need either ticker OR marketId, AND amount
     if (not has_ticker and not has_market) or not has_amount:
@@ -120,20 +147,15 @@ def check_reasoning_action_alignment(
         literacy_bonus += 0.15
 
     # --- 2. Directional Alignment ---
-    # Sentiment indicators
-    bullish_words = ["bullish", "buy", "long", "upward", "positive", "opportunity", "moon"]
-    bearish_words = ["bearish", "sell", "short", "downward", "negative", "avoid", "dump"]
-    wait_words = ["wait", "hold", "unclear", "uncertain", "need more data", "observing"]
-
     # Count sentiment
-    bullish_score = sum(1 for w in bullish_words if w in reasoning_lower)
-    bearish_score = sum(1 for w in bearish_words if w in reasoning_lower)
-    wait_score = sum(1 for w in wait_words if w in reasoning_lower)
+    bullish_score = sum(1 for w in _BULLISH_WORDS if w in reasoning_lower)
+    bearish_score = sum(1 for w in _BEARISH_WORDS if w in reasoning_lower)
+    wait_score = sum(1 for w in _WAIT_WORDS if w in reasoning_lower)
 
     # Check alignment
-    is_buy = action_type in ["buy", "buy_prediction", "open_perp", "long"]
-    is_sell = action_type in ["sell", "sell_prediction", "close_perp", "short"]
-    is_wait = action_type in ["wait", "hold"]
+    is_buy = action_type in _BUY_ACTIONS
+    is_sell = action_type in _SELL_ACTIONS
+    is_wait = action_type in _WAIT_ACTIONS
 
     if is_buy:
         if bullish_score > bearish_score:
@@ -165,24 +187,14 @@ def check_reasoning_coherence(reasoning_text: str) -> float:
 
     score = 0.0
     text = reasoning_text
+    text_lower = text.lower()
 
     # Check for structure (numbered lists, bullet points)
-    if re.search(r"(\d+[\.\):]|\-|\*|\•)", text):
+    if _STRUCTURE_RE.search(text):
         score += 0.25
 
     # Check for conclusion markers
-    conclusion_markers = [
-        "therefore",
-        "conclusion",
-        "decision",
-        "recommend",
-        "suggest",
-        "final",
-        "result",
-        "action:",
-        "execute",
-    ]
-    if any(marker in text.lower() for marker in conclusion_markers):
+    if any(marker in text_lower for marker in _CONCLUSION_MARKERS):
         score += 0.25
 
     # Check sentence count (2-10 sentences is ideal)
@@ -193,7 +205,7 @@ def check_reasoning_coherence(reasoning_text: str) -> float:
         score += 0.1  # Too verbose
 
     # Check for repetitive patterns (bad quality indicator)
-    words = text.lower().split()
+    words = text_lower.split()
     if len(words) > 10:
         unique_ratio = len(set(words)) / len(words)
         if unique_ratio > 0.4:
@@ -204,7 +216,7 @@ def check_reasoning_coherence(reasoning_text: str) -> float:
         score += 0.1
 
     # Check for numeric analysis (prices, percentages)
-    if re.search(r"\$?\d+(?:\.\d+)?(?:%|k|K|M)?", text):
+    if _NUMERIC_RE.search(text):
         score += 0.15  # Contains quantitative analysis
 
     return min(max(score, 0.0), 1.0)
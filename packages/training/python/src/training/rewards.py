@@ -13,6 +13,7 @@ Also provides utilities for normalizing and comparing rewards.
 
 import math
 
+import numpy as np
 from pydantic import BaseModel, Field
 
 
@@ -218,6 +219,119 @@ def composite_reward(
     return max(-1.0, min(1.0, composite))
 
 
+def calculate_pnl_reward_batch(start_balances: np.ndarray, end_balances: np.ndarray) -> np.ndarray:
+    """
+    Vectorized calculate_pnl_reward over arrays of balances.
+
+    Args:
+        start_balances: Starting balance per trajectory
+        end_balances: Ending balance per trajectory
+
+    Returns:
+        Array of PnL rewards, elementwise equal to calculate_pnl_reward
+    """
+    start = np.asarray(start_balances, dtype=np.float64)
+    end = np.asarray(end_balances, dtype=np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scaled = np.clip((end - start) / start * 10.0, -1.0, 1.0)
+
+    rewards = np.where(start > 0, scaled, 0.0)
+    return np.where(end <= 0, -10.0, rewards)
+
+
+def calculate_risk_reward_batch(exposures: np.ndarray, action_types: list[str]) -> np.ndarray:
+    """
+    Vectorized calculate_risk_reward over per-step exposures and action types.
+
+    Args:
+        exposures: Exposure fraction per step
+        action_types: Action type per step (empty string when there was no action)
+
+    Returns:
+        Array of risk rewards, elementwise equal to calculate_risk_reward
+    """
+    exposure = np.asarray(exposures, dtype=np.float64)
+    is_buying = np.fromiter(
+        (
+            bool(act) and any(x in act.lower() for x in ("buy", "long", "open"))
+            for act in action_types
+        ),
+        dtype=bool,
+        count=len(action_types),
+    )
+    return np.where((exposure > 0.80) & is_buying, -0.5, 0.0)
+
+
+def composite_reward_batch(
+    start_balances: np.ndarray,
+    end_balances: np.ndarray,
+    format_scores: np.ndarray,
+    reasoning_scores: np.ndarray,
+    pnl_weight: float = 0.5,
+    format_weight: float = 0.3,
+    reasoning_weight: float = 0.2,
+) -> np.ndarray:
+    """
+    Vectorized composite_reward for trajectories scored on PnL, format and reasoning.
+
+    Elementwise equal to composite_reward on inputs that only carry balances and
+    format/reasoning scores (no variance, drawdown, risky or counted actions). Rows
+    with both quality scores at zero take composite_reward's legacy weighting and are
+    scored by composite_reward itself.
+
+    Args:
+        start_balances: Starting balance per trajectory
+        end_balances: Ending balance per trajectory
+        format_scores: Format quality score per trajectory
+        reasoning_scores: Reasoning quality score per trajectory
+        pnl_weight: Weight for PnL score
+        format_weight: Weight for format score
+        reasoning_weight: Weight for reasoning score
+
+    Returns:
+        Array of composite rewards
+    """
+    start = np.asarray(start_balances, dtype=np.float64)
+    end = np.asarray(end_balances, dtype=np.float64)
+    format_arr = np.asarray(format_scores, dtype=np.float64)
+    reasoning_arr = np.asarray(reasoning_scores, dtype=np.float64)
+
+    pnl_scores = calculate_pnl_reward_batch(start, end)
+
+    total_weight = pnl_weight + format_weight + reasoning_weight
+    if total_weight == 0:
+        scored = np.zeros_like(pnl_scores)
+    else:
+        scored = np.clip(
+            (
+                pnl_scores * pnl_weight
+                + format_arr * format_weight
+                + reasoning_arr * reasoning_weight
+            )
+            / total_weight,
+            -1.0,
+            1.0,
+        )
+
+    # Bankruptcy override
+    composite = np.where(pnl_scores <= -5.0, pnl_scores, scored)
+
+    # The legacy weighting mixes four component rewards; route those rows through
+    # composite_reward so they cannot drift from it (validation scores only a handful)
+    for i in np.flatnonzero((format_arr == 0) & (reasoning_arr == 0)):
+        composite[i] = composite_reward(
+            TrajectoryRewardInputs(
+                final_pnl=end[i] - start[i], starting_balance=start[i], end_balance=end[i]
+            ),
+            pnl_weight=pnl_weight,
+            format_weight=format_weight,
+            reasoning_weight=reasoning_weight,
+        )
+
+    return composite
+
+
 def relative_scores(rewards: list[float]) -> list[float]:
     """
     Convert absolute rewards to relative scores.
@@ -344,15 +458,29 @@ class RewardNormalizer:
         std = math.sqrt(self.var / (self.count - 1) + self.epsilon)
         return (reward - self.mean) / std
 
-    def update_batch(self, rewards: list[float]) -> None:
+    def update_batch(self, rewards: list[float] | np.ndarray) -> None:
         """
         Update statistics with batch of rewards.
 
+        Computes the batch moments with NumPy and merges them into the running
+        statistics (Chan et al.), equivalent to calling update() per reward.
+
         Args:
-            rewards: List of reward values
+            rewards: List or array of reward values
         """
-        for r in rewards:
-            self.update(r)
+        batch = np.asarray(rewards, dtype=np.float64)
+        if batch.size == 0:
+            return
+
+        batch_count = batch.size
+        batch_mean = float(batch.mean())
+        batch_m2 = float(np.square(batch - batch_mean).sum())
+
+        total = self.count + batch_count
+        delta = batch_mean - self.mean
+        self.mean += delta * batch_count / total
+        self.var += batch_m2 + delta * delta * self.count * batch_count / total
+        self.count = total
 
     def normalize_batch(self, rewards: list[float]) -> list[float]:
         """
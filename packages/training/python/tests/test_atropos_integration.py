@@ -8,106 +8,94 @@ Tests:
 4. Environment can be instantiated (mock mode)
 """
 
+import importlib.util
 from datetime import datetime
 
+import numpy as np
 import pytest
-
-# Check for optional dependencies
-HAS_TORCH = False
-try:
-    import torch
-
-    _ = torch.__version__  # Use the import to satisfy linter
-    HAS_TORCH = True
-except ImportError:
-    pass
+from src.data_bridge import (
+    BabylonToAtroposConverter,
+    ScoredGroupResult,
+    calculate_dropout_rate,
+)
+from src.models import (
+    Action,
+    AtroposScoredGroup,
+    BabylonTrajectory,
+    EnvironmentState,
+    LLMCall,
+    TrajectoryStep,
+)
+from src.training.rewards import (
+    RewardNormalizer,
+    TrajectoryRewardInputs,
+    calculate_risk_reward,
+    calculate_risk_reward_batch,
+    composite_reward,
+    composite_reward_batch,
+    efficiency_reward,
+    pnl_reward,
+    relative_scores,
+)
+
+# Check for optional dependencies without importing them
+HAS_TORCH = importlib.util.find_spec("torch") is not None
+
+# Torch-backed components; a real import error fails collection instead of skipping
+if HAS_TORCH:
+    from src.training import (
+        AtroposTrainingConfig,
+        BabylonAtroposTrainer,
+        BabylonEnvConfig,
+        BabylonRLAIFEnv,
+    )
 
 requires_torch = pytest.mark.skipif(not HAS_TORCH, reason="torch not installed")
 
+# Fixed timestamp keeps sample data deterministic across runs
+_FIXED_TIME = datetime(2024, 1, 1, 0, 0, 0)
+
 
 class TestImports:
     """Verify all modules can be imported"""
 
     def test_import_models(self):
-        from src.models import (
-            AtroposScoredGroup,
-            BabylonTrajectory,
-        )
-
         assert BabylonTrajectory is not None
         assert AtroposScoredGroup is not None
 
     def test_import_converter(self):
-        from src.data_bridge import (
-            BabylonToAtroposConverter,
-            ScoredGroupResult,
-        )
-
         assert BabylonToAtroposConverter is not None
         assert ScoredGroupResult is not None
 
     def test_import_rewards(self):
-        from src.training.rewards import (
-            RewardNormalizer,
-            TrajectoryRewardInputs,
-            pnl_reward,
-        )
-
         assert pnl_reward is not None
         assert RewardNormalizer is not None
         assert TrajectoryRewardInputs is not None
 
     @requires_torch
     def test_import_trainer(self):
-        from src.training import (
-            BabylonAtroposTrainer,
-        )
-
         assert BabylonAtroposTrainer is not None
 
     @requires_torch
     def test_import_environment(self):
-        from src.training import (
-            BabylonRLAIFEnv,
-        )
-
         assert BabylonRLAIFEnv is not None
 
 
 class TestRewardFunctions:
     """Test reward calculation functions"""
 
-    def test_pnl_reward_positive(self):
-        from src.training.rewards import TrajectoryRewardInputs, pnl_reward
-
-        inputs = TrajectoryRewardInputs(final_pnl=500.0, starting_balance=10000.0)
+    @pytest.mark.parametrize(("final_pnl", "sign"), [(500.0, 1), (-500.0, -1), (0.0, 0)])
+    def test_pnl_reward_sign(self, final_pnl, sign):
+        inputs = TrajectoryRewardInputs(final_pnl=final_pnl, starting_balance=10000.0)
         reward = pnl_reward(inputs)
-        assert reward > 0
-
-    def test_pnl_reward_negative(self):
-        from src.training.rewards import TrajectoryRewardInputs, pnl_reward
-
-        inputs = TrajectoryRewardInputs(final_pnl=-500.0, starting_balance=10000.0)
-        reward = pnl_reward(inputs)
-        assert reward < 0
-
-    def test_pnl_reward_zero(self):
-        from src.training.rewards import TrajectoryRewardInputs, pnl_reward
-
-        inputs = TrajectoryRewardInputs(final_pnl=0.0, starting_balance=10000.0)
-        reward = pnl_reward(inputs)
-        assert reward == 0.0
+        assert (reward > 0) - (reward < 0) == sign
 
     def test_efficiency_reward(self):
-        from src.training.rewards import TrajectoryRewardInputs, efficiency_reward
-
         inputs = TrajectoryRewardInputs(final_pnl=500.0, starting_balance=10000.0, total_actions=5)
         reward = efficiency_reward(inputs)
         assert -1.0 <= reward <= 1.0
 
     def test_composite_reward(self):
-        from src.training.rewards import TrajectoryRewardInputs, composite_reward
-
         inputs = TrajectoryRewardInputs(
             final_pnl=500.0,
             starting_balance=10000.0,
@@ -119,9 +107,40 @@ class TestRewardFunctions:
         reward = composite_reward(inputs)
         assert -1.0 <= reward <= 1.0
 
-    def test_relative_scores(self):
-        from src.training.rewards import relative_scores
+    def test_composite_reward_batch_matches_scalar(self):
+        start = [10000.0, 10000.0, 10000.0, 10000.0, 0.0]
+        end = [10500.0, 9000.0, -50.0, 10200.0, 100.0]
+        format_scores = [0.8, 0.0, 0.5, 0.0, 0.3]
+        reasoning_scores = [0.7, 0.4, 0.5, 0.0, 0.0]
+
+        batch = composite_reward_batch(start, end, format_scores, reasoning_scores)
+
+        expected = [
+            composite_reward(
+                TrajectoryRewardInputs(
+                    final_pnl=e - s,
+                    starting_balance=s,
+                    end_balance=e,
+                    format_score=f,
+                    reasoning_score=r,
+                )
+            )
+            for s, e, f, r in zip(start, end, format_scores, reasoning_scores, strict=True)
+        ]
+        assert batch.tolist() == pytest.approx(expected)
+
+    def test_risk_reward_batch_matches_scalar(self):
+        exposures = [0.9, 0.9, 0.5, 0.85, 1.0]
+        action_types = ["BUY_SHARES", "sell", "open_long", "", "wait"]
+
+        batch = calculate_risk_reward_batch(exposures, action_types)
+
+        expected = [
+            calculate_risk_reward(x, a) for x, a in zip(exposures, action_types, strict=True)
+        ]
+        assert batch.tolist() == expected
 
+    def test_relative_scores(self):
         # Pass raw reward values, not trajectories
         rewards = [1.0, 0.0, -0.5]
 
@@ -133,102 +152,96 @@ class TestRewardFunctions:
         assert scores[0] > scores[1] > scores[2]
 
     def test_reward_normalizer(self):
-        from src.training.rewards import RewardNormalizer
-
         normalizer = RewardNormalizer(epsilon=1e-8)
 
-        # Update with some rewards
-        normalizer.update(0.5)
-        normalizer.update(0.6)
-        normalizer.update(0.7)
-        normalizer.update(0.8)
+        # Update with some rewards in one vectorized merge
+        normalizer.update_batch(np.array([0.5, 0.6, 0.7, 0.8]))
 
         # Normalize should return a float
         normalized = normalizer.normalize(0.65)
         assert isinstance(normalized, float)
 
-
-class TestConverter:
-    """Test Babylon to Atropos conversion"""
-
-    def create_sample_trajectory(self):
-        """Create a sample trajectory for testing"""
-        from src.models import (
-            Action,
-            BabylonTrajectory,
-            EnvironmentState,
-            LLMCall,
-            TrajectoryStep,
-        )
-
-        steps = []
-        for i in range(5):
-            step = TrajectoryStep(
-                step_number=i,
-                timestamp=1000000 + i * 1000,
-                environment_state=EnvironmentState(
-                    agent_balance=10000.0 + i * 100,
-                    agentPnL=i * 100.0,
-                    open_positions=i,
-                ),
-                provider_accesses=[],
-                llm_calls=[
-                    LLMCall(
-                        model="gpt-4",
-                        system_prompt="You are a trading agent. Analyze markets carefully.",
-                        user_prompt=f"Market update {i}: Current price is $100. Should you buy?",
-                        response=f"Based on my analysis of the market conditions, I recommend action {i}.",
-                        temperature=0.7,
-                        max_tokens=100,
-                        purpose="action",
-                    )
-                ],
-                action=Action(
-                    action_type="trade",
-                    parameters={"amount": 100},
-                    success=True,
-                ),
-                reward=0.1,
-            )
-            steps.append(step)
-
-        return BabylonTrajectory(
-            id="test-1",
-            trajectory_id="traj-1",
-            agent_id="agent-1",
-            window_id="2024-01-01T00:00",
-            start_time=datetime.now(),
-            end_time=datetime.now(),
-            duration_ms=5000,
-            steps=steps,
-            total_reward=0.5,
-            final_pnl=400.0,
-            episode_length=5,
-            final_status="completed",
+        # The batch merge must match sequential Welford updates
+        sequential = RewardNormalizer(epsilon=1e-8)
+        for reward in (0.5, 0.6, 0.7, 0.8):
+            sequential.update(reward)
+        assert normalizer.count == sequential.count
+        assert normalizer.mean == pytest.approx(sequential.mean)
+        assert normalizer.var == pytest.approx(sequential.var)
+
+
+@pytest.fixture(scope="module")
+def sample_trajectory():
+    """Create a sample trajectory shared by the converter tests; copy before changing it"""
+    steps = [
+        TrajectoryStep(
+            step_number=i,
+            timestamp=1000000 + i * 1000,
+            environment_state=EnvironmentState(
+                agent_balance=10000.0 + i * 100,
+                agentPnL=i * 100.0,
+                open_positions=i,
+            ),
+            provider_accesses=[],
+            llm_calls=[
+                LLMCall(
+                    model="gpt-4",
+                    system_prompt="You are a trading agent. Analyze markets carefully.",
+                    user_prompt=f"Market update {i}: Current price is $100. Should you buy?",
+                    response=f"Based on my analysis of the market conditions, I recommend action {i}.",
+                    temperature=0.7,
+                    max_tokens=100,
+                    purpose="action",
+                )
+            ],
+            action=Action(
+                action_type="trade",
+                parameters={"amount": 100},
+                success=True,
+            ),
+            reward=0.1,
         )
+        for i in range(5)
+    ]
+
+    return BabylonTrajectory(
+        id="test-1",
+        trajectory_id="traj-1",
+        agent_id="agent-1",
+        window_id="2024-01-01T00:00",
+        start_time=_FIXED_TIME,
+        end_time=_FIXED_TIME,
+        duration_ms=5000,
+        steps=steps,
+        total_reward=0.5,
+        final_pnl=400.0,
+        episode_length=5,
+        final_status="completed",
+    )
+
+
+@pytest.fixture(scope="module")
+def converter():
+    """Seeded converter shared by the converter tests"""
+    return BabylonToAtroposConverter(seed=0)
 
-    def test_convert_trajectory(self):
-        from src.data_bridge import BabylonToAtroposConverter
 
-        converter = BabylonToAtroposConverter()
-        traj = self.create_sample_trajectory()
+class TestConverter:
+    """Test Babylon to Atropos conversion"""
 
-        result = converter.convert_trajectory(traj)
+    def test_convert_trajectory(self, converter, sample_trajectory):
+        result = converter.convert_trajectory(sample_trajectory)
 
         assert result is not None
         assert len(result.messages) >= 3
         assert result.metadata["trajectory_id"] == "traj-1"
         assert result.metadata["final_pnl"] == 400.0
 
-    def test_convert_window_group(self):
-        from src.data_bridge import BabylonToAtroposConverter
-
-        converter = BabylonToAtroposConverter()
-        trajs = [self.create_sample_trajectory() for _ in range(4)]
-
-        # Modify trajectory IDs
-        for i, t in enumerate(trajs):
-            t.trajectory_id = f"traj-{i}"
+    def test_convert_window_group(self, converter, sample_trajectory):
+        # Shallow copies of the shared trajectory that differ only in ID
+        trajs = [
+            sample_trajectory.model_copy(update={"trajectory_id": f"traj-{i}"}) for i in range(4)
+        ]
 
         result = converter.convert_window_group(trajs, None)
 
@@ -236,14 +249,25 @@ class TestConverter:
         assert len(result.scores) == 4
         assert len(result.messages) == 4
 
+    def test_scored_group_to_padded_arrays(self):
+        group = ScoredGroupResult(
+            tokens=[[1, 2, 3], [4, 5]],
+            masks=[[-100, 2, 3], [-100, 5]],
+            scores=[0.5, -0.5],
+        )
+
+        tokens, masks, lengths = group.to_padded_arrays()
+
+        assert tokens.tolist() == [[1, 2, 3], [4, 5, 0]]
+        assert masks.tolist() == [[-100, 2, 3], [-100, 5, -100]]
+        assert lengths.tolist() == [3, 2]
+
 
 @requires_torch
 class TestTrainerConfig:
     """Test trainer configuration (requires torch)"""
 
     def test_default_config(self):
-        from src.training import AtroposTrainingConfig
-
         config = AtroposTrainingConfig()
 
         assert config.model_name == "Qwen/Qwen2.5-3B-Instruct"
@@ -251,8 +275,6 @@ class TestTrainerConfig:
         assert config.training_steps == 100
 
     def test_custom_config(self):
-        from src.training import AtroposTrainingConfig
-
         config = AtroposTrainingConfig(
             model_name="Qwen/Qwen2.5-7B-Instruct",
             training_steps=50,
@@ -269,8 +291,6 @@ class TestEnvironmentConfig:
     """Test environment configuration (requires torch)"""
 
     def test_default_config(self):
-        from src.training import BabylonEnvConfig
-
         config = BabylonEnvConfig()
 
         assert config.group_size == 4
@@ -278,8 +298,6 @@ class TestEnvironmentConfig:
         assert config.min_agents_per_window == 2
 
     def test_custom_config(self):
-        from src.training import BabylonEnvConfig
-
         config = BabylonEnvConfig(
             group_size=8,
             lookback_hours=48,
@@ -294,23 +312,27 @@ class TestEnvironmentConfig:
 class TestCalculateDropoutRate:
     """Test dropout rate calculation"""
 
-    def test_no_dropout_needed(self):
-        from src.data_bridge import calculate_dropout_rate
-
-        rate = calculate_dropout_rate(500, target_trajectories=1000)
-        assert rate == 0.0
-
-    def test_dropout_needed(self):
-        from src.data_bridge import calculate_dropout_rate
-
-        rate = calculate_dropout_rate(2000, target_trajectories=1000)
-        assert 0.0 < rate <= 0.3
-
-    def test_max_dropout_cap(self):
-        from src.data_bridge import calculate_dropout_rate
-
-        rate = calculate_dropout_rate(10000, target_trajectories=1000, max_dropout=0.2)
-        assert rate == 0.2
+    @pytest.mark.parametrize(
+        ("current", "max_dropout", "expected"),
+        [
+            (500, 0.3, 0.0),  # Already under target: no dropout needed
+            (2000, 0.3, 0.3),  # Needs 0.5, capped at the default maximum
+            (10000, 0.2, 0.2),  # Needs 0.9, capped at a custom maximum
+        ],
+    )
+    def test_dropout_rate(self, current, max_dropout, expected):
+        rate = calculate_dropout_rate(current, target_trajectories=1000, max_dropout=max_dropout)
+        assert isinstance(rate, float)
+        assert rate == pytest.approx(expected)
+
+    def test_dropout_rate_array(self):
+        # The same three cases in one call; max_dropout broadcasts against the counts
+        rates = calculate_dropout_rate(
+            np.array([500, 2000, 10000]),
+            target_trajectories=1000,
+            max_dropout=np.array([0.3, 0.3, 0.2]),
+        )
+        assert rates.tolist() == pytest.approx([0.0, 0.3, 0.2])
 
 
 if __name__ == "__main__":